@@ -0,0 +1,176 @@
+"""Archival of old widget states.
+
+Most reads are of the heads of pages, but most ``WidgetState''s are
+history, read only for previous versions (see ``Page.prev''), reverts
+& the like. Old states can be moved out of the table into *segments*:
+append-only files of encoded states (see codec), read through mmap.
+The table keeps a *stub* in place of each archived state:
+
+  '@segment:offset:length'
+
+which ``WidgetStateField'' resolves transparently, so that archived
+states thaw as any other (and their ``previous'' links are untouched).
+
+Segments live in the WIDGETS_ARCHIVE_PATH directory. They are only
+ever appended to (by ``archive_states''), never rewritten: collected
+states (see garbage) leave dead records behind."""
+from __future__ import absolute_import
+from __future__ import with_statement
+
+import fcntl
+import mmap
+import os
+import threading
+
+from django.conf            import settings
+from django.core.exceptions import ImproperlyConfigured
+
+STUB = '@'
+
+SEGMENT_BYTES = getattr(settings, 'WIDGETS_ARCHIVE_SEGMENT_BYTES', 256 << 20)
+
+class Segments(object):
+    """The segment files in the directory `path'."""
+    def __init__(self, path):
+        self.path = path
+        self.maps = {}                  # segment number -> mmap
+        self.lock = threading.Lock()
+
+    def filename(self, number):
+        return os.path.join(self.path, 'segment-%06d' % number)
+
+    def last(self):
+        """The number of the segment to append to."""
+        numbers = [int(name.split('-')[1]) for name in os.listdir(self.path)
+                                           if name.startswith('segment-')]
+        if not numbers:
+            return 0
+
+        number = max(numbers)
+        if os.path.getsize(self.filename(number)) >= SEGMENT_BYTES:
+            number += 1
+        return number
+
+    def read(self, number, offset, length):
+        with self.lock:
+            region = self.maps.get(number)
+            if region is None or offset + length > len(region):
+                # Not mapped yet, or appended to since.
+                if region is not None:
+                    region.close()
+                f = open(self.filename(number), 'rb')
+                try:
+                    region = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                finally:
+                    f.close()
+                self.maps[number] = region
+
+            return region[offset:offset + length]
+
+    def append(self, records):
+        """Append the encoded states `records' to the last segment,
+        returning the (segment, offset, length) of each. They are on
+        disk when this returns."""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        number = self.last()
+        f = open(self.filename(number), 'ab')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.seek(0, 2)
+            offset, locations = f.tell(), []
+            for record in records:
+                f.write(record)
+                locations.append((number, offset, len(record)))
+                offset += len(record)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()                   # (which releases the lock)
+        return locations
+
+# The configured segments, if any.
+SEGMENTS = None
+if getattr(settings, 'WIDGETS_ARCHIVE_PATH', None):
+    SEGMENTS = Segments(settings.WIDGETS_ARCHIVE_PATH)
+
+def segments():
+    if SEGMENTS is None:
+        raise ImproperlyConfigured, \
+            'Archived widget states need WIDGETS_ARCHIVE_PATH'
+    return SEGMENTS
+
+def is_stub(value):
+    return isinstance(value, basestring) and value[:1] == STUB
+
+def stub_of(number, offset, length):
+    return '%s%d:%d:%d' % (STUB, number, offset, length)
+
+def read_stub(value):
+    """Return the encoded state archived at stub `value'."""
+    number, offset, length = map(int, value[1:].split(':'))
+    return segments().read(number, offset, length)
+
+# | Archiving.
+def archive_states(state_ids):
+    """Move the states `state_ids' to the archive (unless they are
+    archived already), returning the number moved."""
+    from .models import WidgetState
+    from .codec  import encode, is_encoded, update_frozen_states
+    from .loader import thaw_node
+
+    ids, records = [], []
+    for pk, value in WidgetState.objects.filter(pk__in=state_ids)\
+                                        .values_list('pk', 'widget'):
+        if is_stub(value):
+            continue
+        if not is_encoded(value):
+            value = encode(thaw_node(value))
+        ids.append(pk)
+        records.append(value)
+
+    if not records:
+        return 0
+
+    # Segments come first: a stub must never point to nothing.
+    locations = segments().append(records)
+    update_frozen_states(
+        WidgetState._meta.db_table,
+        [(stub_of(*location), pk) for pk, location in zip(ids, locations)])
+    return len(ids)
+
+def archivable_states(page, keep_versions=None, max_age=None, live=None):
+    """Return the ids of the states of `page' (a ``WikiPage'') to
+    archive: the versions past the `keep_versions' latest ones, and
+    those changed before the datetime `max_age', along with the states
+    of their widgets. Identical states are shared by pages (see
+    ``Widget.freeze_shared''), so those part of the head of any page
+    are left out: `live' marks them (see ``garbage.mark_heads''), and
+    is made if not given."""
+    from .models  import WidgetState, WikiPageChange
+    from .garbage import mark_heads, mark_trees
+
+    head_id = page.head_id
+    origin_id, version = WidgetState.objects.filter(pk=head_id)\
+                                    .values_list('origin', 'version')[0]
+    roots = set()
+    if keep_versions is not None and version is not None \
+            and version >= keep_versions:
+        origin_id = origin_id or head_id
+        roots.update(WidgetState.objects.filter(
+            origin=origin_id, version__lte=version - keep_versions)
+            .values_list('pk', flat=True))
+        roots.add(origin_id)
+    if max_age is not None:
+        roots.update(WikiPageChange.objects.filter(
+            page=page, changed_on__lt=max_age).exclude(state=None)
+            .values_list('state', flat=True))
+    roots.discard(head_id)
+
+    if not roots:
+        return set()
+
+    if live is None:
+        live = mark_heads()
+    return set(pk for pk in mark_trees(set(), roots) if pk not in live)
@@ -0,0 +1,164 @@
+"""Encoding of frozen widgets in ``WidgetState.widget''.
+
+An encoded state is a header byte followed by a base64-encoded
+payload. The header records the format of the payload:
+
+  '!' - a pickle (of the highest protocol), zlib-compressed.
+  '$' - the same, uncompressed (for tiny states, where zlib doesn't
+        pay for itself).
+  '@' - a stub for a state moved to the archive (see archive), which
+        holds it in one of the formats above.
+
+Rows written before (by a plain ``PickleField'') have no header, and
+are still read as they were; ``recode_legacy_states()'' rewrites them
+in the background. We keep track of what decoding costs, per format,
+in ``STATS''."""
+from __future__ import absolute_import
+
+import cPickle
+import time
+import zlib
+from base64 import b64encode, b64decode
+
+from django.conf import settings
+from django.db   import connection
+
+from util.db            import nestable_commit_on_success
+from util.django_fields import PickleField
+
+from .archive import is_stub, read_stub
+
+ZLIB  = '!'
+PLAIN = '$'
+
+COMPRESSION_LEVEL = getattr(settings, 'WIDGETS_STATE_COMPRESSION_LEVEL', 6)
+
+class DecodeStats(object):
+    """Counts decoded states, their encoded size & the time spent
+    decoding them, per format."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.formats = {}
+
+    def record(self, format, size, seconds):
+        count, total_size, total_seconds = \
+            self.formats.get(format, (0, 0, 0.0))
+        self.formats[format] = \
+            (count + 1, total_size + size, total_seconds + seconds)
+
+    def summary(self):
+        """Return a dict of format -> dict of (count, bytes, avg_bytes,
+        avg_usecs)."""
+        summary = {}
+        for format, (count, size, seconds) in self.formats.iteritems():
+            summary[format] = {
+                'count'     : count,
+                'bytes'     : size,
+                'avg_bytes' : size / count,
+                'avg_usecs' : 1e6 * seconds / count,
+            }
+        return summary
+
+STATS = DecodeStats()
+
+def is_encoded(value):
+    return isinstance(value, basestring) and value[:1] in (ZLIB, PLAIN)
+
+def encode(obj):
+    pickled    = cPickle.dumps(obj, cPickle.HIGHEST_PROTOCOL)
+    compressed = zlib.compress(pickled, COMPRESSION_LEVEL)
+    if len(compressed) < len(pickled):
+        return ZLIB + b64encode(compressed)
+    else:
+        return PLAIN + b64encode(pickled)
+
+def decode(value):
+    start   = time.time()
+    payload = b64decode(value[1:])
+    if value[0] == ZLIB:
+        payload = zlib.decompress(payload)
+    obj = cPickle.loads(payload)
+    STATS.record(value[0], len(value), time.time() - start)
+    return obj
+
+class Encoded(str):
+    """A value that is encoded already (eg. to digest it), which
+    ``WidgetStateField'' keeps & stores as it is."""
+
+class WidgetStateField(PickleField):
+    """A ``PickleField'' that stores its values with ``encode()'', and
+    reads both encoded & legacy values."""
+    def to_python(self, value):
+        if isinstance(value, Encoded):
+            # Being saved: decoding it would only have it encoded again.
+            return value
+        if is_stub(value):
+            value = read_stub(value)
+
+        if is_encoded(value):
+            return decode(value)
+        elif isinstance(value, basestring):
+            start = time.time()
+            obj   = super(WidgetStateField, self).to_python(value)
+            STATS.record('legacy', len(value), time.time() - start)
+            return obj
+        else:
+            return super(WidgetStateField, self).to_python(value)
+
+    def get_db_prep_value(self, value):
+        if value is None:
+            return None
+        elif isinstance(value, Encoded):
+            return str(value)
+        return encode(value)
+
+    def get_db_prep_save(self, value):
+        return self.get_db_prep_value(value)
+
+# | Rewriting legacy rows.
+def recode_legacy_states(batch_size=500, start_pk=0):
+    """Rewrite legacy (unencoded) states, `batch_size' rows at a time
+    in order of id, starting after `start_pk'. This yields, after each
+    batch, a tuple of (last pk, rows rewritten, bytes before, bytes
+    after), so that callers can report progress & resume later."""
+    from .models import WidgetState
+    from .loader import thaw_node
+
+    table = WidgetState._meta.db_table
+    last  = start_pk
+    while True:
+        rows = list(WidgetState.objects.filter(pk__gt=last).order_by('pk')
+                               .values_list('pk', 'widget')[:batch_size])
+        if not rows:
+            break
+
+        last = rows[-1][0]
+        params, before, after = [], 0, 0
+        for pk, value in rows:
+            if (not isinstance(value, basestring) or is_encoded(value)
+                or is_stub(value)):
+                continue
+            # Children stay state ids, so we write back exactly the
+            # same state. Decoding the result back checks it (&
+            # measures it, in ``STATS'').
+            encoded = encode(thaw_node(value))
+            thaw_node(encoded)
+            params.append((encoded, pk))
+            before += len(value)
+            after  += len(encoded)
+
+        if params:
+            update_frozen_states(table, params)
+
+        yield last, len(params), before, after
+
+@nestable_commit_on_success
+def update_frozen_states(table, params):
+    """Overwrite frozen states in place, given `params' of (encoded
+    state, id)."""
+    # Updating through the ORM would run the (already encoded) values
+    # through the field again.
+    connection.cursor().executemany(
+        'UPDATE %s SET widget = %%s WHERE id = %%s' % table, params)
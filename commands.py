@@ -37,4 +37,129 @@ class Commands(object):
         wiki_page.photos.all().delete()
         wiki_page.delete()
 
+    def cmd_recode_widget_states(self, batch_size=500, start_pk=0):
+        """Rewrite widget states stored in the legacy (plain pickle)
+        format with the compressed encoding, `batch_size' rows at a
+        time. Interrupted runs can be resumed from the last reported
+        id with `start_pk'."""
+        import conf; conf.configure_django('www.settings')
+        from www.widgets.codec import recode_legacy_states, STATS
+
+        rewritten, before, after = 0, 0, 0
+        for last, count, nbefore, nafter in recode_legacy_states(
+                int(batch_size), int(start_pk)):
+            rewritten += count
+            before    += nbefore
+            after     += nafter
+            print 'up to id %d: %d rewritten, %d -> %d bytes' % (
+                last, rewritten, before, after)
+
+        for format, stats in sorted(STATS.summary().items()):
+            print '%-6s decoded %d, avg %d bytes, %.1f usecs' % (
+                format, stats['count'], stats['avg_bytes'], stats['avg_usecs'])
+
+    def cmd_number_widget_states(self):
+        """Number the versions of existing pages (see
+        ``WidgetState.version''), for those histories that aren't
+        numbered yet. This can be run (& interrupted) at any time."""
+        import conf; conf.configure_django('www.settings')
+        from www.widgets.models import WidgetState, WikiPage
+
+        total = 0
+        for slug, head_id in WikiPage.objects.values_list('slug', 'head'):
+            count = WidgetState.objects.number_versions(head_id)
+            if count:
+                total += count
+                print '%s: %d states numbered' % (slug, count)
+        print '%d states numbered' % total
+
+    def cmd_backfill_wiki_page_coordinates(self):
+        """Fill in the coordinates of existing pages (see
+        ``WikiPage.latitude''), for those that don't have them yet.
+        This can be run (& interrupted) at any time."""
+        import conf; conf.configure_django('www.settings')
+        from www.widgets.loader import thaw
+        from www.widgets.models import WikiPage, coordinates_of_page
+
+        total = 0
+        for pk, slug, head_id in WikiPage.objects.filter(latitude=None)\
+                                         .values_list('pk', 'slug', 'head'):
+            # (Only the page itself is thawed, not its widgets.)
+            latitude, longitude = coordinates_of_page(thaw(head_id))
+            if latitude is None:
+                continue
+            WikiPage.objects.filter(pk=pk).update(latitude=latitude,
+                                                  longitude=longitude)
+            total += 1
+            print '%s: %s, %s' % (slug, latitude, longitude)
+        print '%d pages placed' % total
+
+    def cmd_collect_widget_states(self, marks_path, batch_size=500,
+                                  start_pk=None, dry_run=False):
+        """Delete the widget states that no page or change refers to
+        (see www.widgets.garbage). The reachable states are marked
+        first, and the marks saved in `marks_path'; an interrupted run
+        is resumed from them (and from the last reported id with
+        `start_pk'). A `dry_run' only reports what would be reclaimed."""
+        import conf; conf.configure_django('www.settings')
+        import os
+        from www.widgets.garbage import Marks, mark, sweep
+
+        if os.path.exists(marks_path):
+            marks = Marks.load(marks_path)
+            print 'resuming with the marks in %s' % marks_path
+        else:
+            marks = mark(int(batch_size))
+            marks.save(marks_path)
+            print 'marked, up to id %d' % marks.max_pk
+
+        deleted, retired, size = 0, 0, 0
+        for last, ndeleted, nretired, nsize in sweep(
+                marks, int(batch_size), start_pk and int(start_pk), dry_run):
+            deleted += ndeleted
+            retired += nretired
+            size    += nsize
+            print 'down to id %d: %d deleted, %d retired, %d bytes' % (
+                last, deleted, retired, size)
+
+        if dry_run:
+            print '%d bytes reclaimable' % size
+        else:
+            # Retired states are deleted by the next collection, which
+            # needs marks of its own.
+            os.remove(marks_path)
+
+    def cmd_archive_widget_states(self, keep_versions=None, max_age_days=None,
+                                  batch_size=500):
+        """Move the history of pages to the archive (see
+        www.widgets.archive): the versions past the `keep_versions'
+        latest ones, and those older than `max_age_days'. Archived
+        states are skipped, so this can be run again at any time."""
+        import conf; conf.configure_django('www.settings')
+        from datetime import datetime, timedelta
+        from www.widgets.archive import archivable_states, archive_states
+        from www.widgets.garbage import mark_heads
+        from www.widgets.models  import WikiPage
+
+        if keep_versions is not None:
+            keep_versions = int(keep_versions)
+        max_age = None
+        if max_age_days is not None:
+            max_age = datetime.now() - timedelta(days=int(max_age_days))
+
+        # Archiving moves no state in or out of the heads of pages.
+        live = mark_heads()
+
+        total, batch_size = 0, int(batch_size)
+        for page in WikiPage.objects.all():
+            state_ids = list(archivable_states(page, keep_versions, max_age,
+                                               live))
+            count = 0
+            for i in range(0, len(state_ids), batch_size):
+                count += archive_states(state_ids[i:i + batch_size])
+            if count:
+                total += count
+                print '%s: %d states archived' % (page.slug, count)
+        print '%d states archived' % total
+
 COMMANDS = Commands()
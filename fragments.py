@@ -0,0 +1,62 @@
+"""Caching of rendered widgets.
+
+Rendering a widget in view mode depends only on its state (which never
+changes, see statecache), its namespace, the template it is rendered
+in & the page it is on (for its URLs). Fragments are cached under a
+key derived from all of these, so a page re-renders only the widgets
+that changed since they were cached -- across ``OneColumnPage.render'',
+``render_embed'' & ``render_readonly''.
+
+The cache is behind the same pluggable backends as the shared state
+cache, configured by the WIDGETS_FRAGMENT_CACHE setting (eg.
+'memcached://host:11211/', or 'locmem://' for tests & development)."""
+from __future__ import absolute_import
+
+import hashlib
+
+from django.conf             import settings
+from django.utils.safestring import mark_safe
+
+from util.dynvar import bindings
+
+from .statecache import backend_of_uri
+
+# The configured backend, if any.
+FRAGMENTS = None
+if getattr(settings, 'WIDGETS_FRAGMENT_CACHE', None):
+    FRAGMENTS = backend_of_uri(settings.WIDGETS_FRAGMENT_CACHE)
+
+TIMEOUT = getattr(settings, 'WIDGETS_FRAGMENT_CACHE_TIMEOUT', 60*60*24)
+
+def key_of_widget(widget, template, page_url):
+    """Return the cache key for `widget' rendered in `template' on the
+    page at `page_url', or None if it can't be cached: it hasn't been
+    frozen yet, or has changed since."""
+    if FRAGMENTS is None:
+        return None
+
+    state_id = widget._state_id
+    session  = getattr(bindings, 'freeze_session', None)
+    if not state_id or (session is not None and session.is_dirty(widget)):
+        return None
+
+    return 'widgets_fragment:' + hashlib.sha1('%d %s %s %d %s' % (
+        state_id, widget.namespace, template, widget.editable, page_url)
+    ).hexdigest()
+
+def get_many(keys):
+    """Look up fragments, returning a dict of key -> fragment for those
+    found."""
+    if FRAGMENTS is None or not keys:
+        return {}
+
+    # Backends may not keep fragments marked safe.
+    return dict((key, mark_safe(fragment))
+                for key, fragment in FRAGMENTS.get_many(keys).iteritems())
+
+def put_many(fragments):
+    """Cache the dict `fragments' (key -> fragment)."""
+    if FRAGMENTS is None or not fragments:
+        return
+
+    FRAGMENTS.set_many(fragments, TIMEOUT)
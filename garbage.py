@@ -0,0 +1,220 @@
+"""Collect the ``WidgetState''s that nothing refers to anymore.
+
+Superseded child states (and the intermediate states of transcoding)
+are left behind as pages change. States are *reachable* from the heads
+of pages (``WikiPage.head'') and from changes (``WikiPageChange.state''),
+through their ``previous'' & ``origin'' links and their children.
+Collecting is done in two phases:
+
+  - ``mark()'' streams over the table, newest states first, recording
+    the reachable ones in a bitmap (``Marks''). Since states almost
+    always refer to older states, a single pass will do.
+
+  - ``sweep()'' then streams over the table again, deleting what
+    hasn't been marked, a batch at a time.
+
+States created after marking has begun are never swept. The only way
+an unreachable state can be referred to again is by sharing its digest
+(see ``Widget.freeze_shared''), so rather than deleting those, the
+sweep first *retires* them by clearing their digest: they are deleted
+by a later collection. Marks can be saved, so that an interrupted sweep
+can be resumed with them."""
+from __future__ import absolute_import
+
+import array
+
+from django.db import connection
+
+from util.db import nestable_commit_on_success
+
+from .       import statecache
+from .models import WidgetState, WikiPage, WikiPageChange
+from .loader import thaw_node
+
+class Marks(object):
+    """A bitmap of the reachable states among those up to `max_pk'.
+    States past `max_pk' are newer than the marks, and considered
+    reachable."""
+    def __init__(self, max_pk, bits=None):
+        self.max_pk = max_pk
+        if bits is None:
+            bits = array.array('B', [0]) * (max_pk // 8 + 1)
+        self.bits = bits
+
+    def mark(self, pk):
+        if pk <= self.max_pk:
+            self.bits[pk >> 3] |= 1 << (pk & 7)
+
+    # Marks fill in like sets (see ``mark_trees'').
+    add = mark
+
+    def __contains__(self, pk):
+        return pk > self.max_pk or bool(self.bits[pk >> 3] & (1 << (pk & 7)))
+
+    def save(self, path):
+        f = open(path, 'wb')
+        try:
+            f.write('%d\n' % self.max_pk)
+            self.bits.tofile(f)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, path):
+        f = open(path, 'rb')
+        try:
+            max_pk = int(f.readline())
+            bits   = array.array('B')
+            bits.fromfile(f, max_pk // 8 + 1)
+        finally:
+            f.close()
+        return cls(max_pk, bits)
+
+def references(state_ids):
+    """Yield the states referred to by each of `state_ids', as tuples
+    of (state id, list of state ids)."""
+    rows = WidgetState.objects.filter(pk__in=state_ids).values_list(
+        'pk', 'previous', 'origin', 'widget')
+    for pk, previous_id, origin_id, value in rows:
+        refs = [ref for ref in (previous_id, origin_id) if ref]
+        yield pk, refs + thaw_node(value).children.values()
+
+def children(state_ids):
+    """Yield the children of each of `state_ids', as tuples of (state
+    id, list of state ids)."""
+    rows = WidgetState.objects.filter(pk__in=state_ids).values_list(
+        'pk', 'widget')
+    for pk, value in rows:
+        yield pk, thaw_node(value).children.values()
+
+def mark_trees(marks, state_ids, batch_size=500):
+    """Mark the states of the trees rooted at `state_ids' (their
+    widgets, not their history) in `marks', a ``Marks'' or a set, which
+    is returned. States are read from the table, bypassing the state
+    cache: they are mostly ones nobody reads."""
+    todo = [pk for pk in set(state_ids) if pk not in marks]
+    for pk in todo:
+        marks.add(pk)
+    while todo:
+        batch, todo = todo[:batch_size], todo[batch_size:]
+        for pk, child_ids in children(batch):
+            for child_id in child_ids:
+                if child_id not in marks:
+                    marks.add(child_id)
+                    todo.append(child_id)
+    return marks
+
+def mark_heads(batch_size=500):
+    """Mark the states of the trees of the heads of pages, returning
+    the ``Marks''."""
+    # Children are frozen before their parents, so once we have the
+    # heads, the newest state bounds their trees.
+    heads  = list(WikiPage.objects.exclude(head=None)
+                          .values_list('head', flat=True))
+    newest = list(WidgetState.objects.order_by('-pk')
+                             .values_list('pk', flat=True)[:1])
+    return mark_trees(Marks(newest and newest[0] or 0), heads, batch_size)
+
+def mark(batch_size=500):
+    """Mark the states reachable from pages & changes, returning the
+    ``Marks''."""
+    newest = list(WidgetState.objects.order_by('-pk')
+                             .values_list('pk', flat=True)[:1])
+    marks  = Marks(newest and newest[0] or 0)
+
+    for pk in WikiPage.objects.values_list('head', flat=True):
+        marks.mark(pk)
+    for pk in WikiPageChange.objects.exclude(state=None)\
+                                    .values_list('state', flat=True):
+        marks.mark(pk)
+
+    # Referred to states we have already scanned past (eg. the
+    # children of states overwritten in place by older versions of
+    # transcoding).
+    late = []
+
+    high = marks.max_pk + 1
+    while True:
+        batch = list(WidgetState.objects.filter(pk__lt=high).order_by('-pk')
+                                .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+
+        # States of this batch may refer to each other, so we follow
+        # them until there's nothing new.
+        followed = set()
+        while True:
+            todo = [pk for pk in batch if pk in marks and pk not in followed]
+            if not todo:
+                break
+            followed.update(todo)
+            for pk, refs in references(todo):
+                for ref in refs:
+                    if ref not in marks:
+                        marks.mark(ref)
+                        if ref >= high:
+                            late.append(ref)
+
+        high = batch[-1]
+
+    while late:
+        todo, late = late[:batch_size], late[batch_size:]
+        for pk, refs in references(todo):
+            for ref in refs:
+                if ref not in marks:
+                    marks.mark(ref)
+                    late.append(ref)
+
+    return marks
+
+def sweep(marks, batch_size=500, start_pk=None, dry_run=False):
+    """Delete the unmarked states, `batch_size' rows at a time, newest
+    first (so that no state is deleted before those referring to it),
+    starting before `start_pk'. States with a digest are only retired.
+    This yields, after each batch, a tuple of (last pk, states deleted,
+    states retired, bytes reclaimed), so that callers can report
+    progress & resume later. A `dry_run' only counts."""
+    table  = WidgetState._meta.db_table
+    cursor = connection.cursor()
+    high   = start_pk or marks.max_pk + 1
+    while True:
+        # Sizes are taken in the database: there's no need to fetch
+        # the states themselves.
+        cursor.execute(
+            'SELECT id, digest IS NULL, LENGTH(widget) FROM %s '
+            'WHERE id < %%s ORDER BY id DESC LIMIT %%s' % table,
+            [high, batch_size])
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        high = rows[-1][0]
+        deleted, retired, size = [], [], 0
+        for pk, retired_already, length in rows:
+            if pk in marks:
+                continue
+            if retired_already:
+                deleted.append(pk)
+            else:
+                retired.append(pk)
+            size += length or 0
+
+        if not dry_run:
+            _collect(table, deleted, retired)
+
+        yield high, len(deleted), len(retired), size
+
+@nestable_commit_on_success
+def _collect(table, deleted, retired):
+    cursor = connection.cursor()
+    if retired:
+        # Retired states may still refer to states we delete: their
+        # links mean nothing anymore.
+        cursor.execute('UPDATE %s SET digest = NULL, previous_id = NULL, '
+                       'origin_id = NULL WHERE id IN (%s)'
+                       % (table, ', '.join(['%s'] * len(retired))), retired)
+    if deleted:
+        cursor.execute('DELETE FROM %s WHERE id IN (%s)'
+                       % (table, ', '.join(['%s'] * len(deleted))), deleted)
+        for pk in deleted:
+            statecache.invalidate_node(pk)
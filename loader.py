@@ -0,0 +1,150 @@
+"""Thaw widget trees from their ``WidgetState''s in bulk.
+
+A frozen widget refers to its children by state id, and thawed widgets
+keep them that way until they are first accessed (see
+``Widget.thawed_children''): reading attributes of the root of a page
+costs a single row. When children are needed, rather than fetching
+each one with a query of its own (and in turn each of their own
+children, and so on), the ``TreeLoader'' collects the child state ids
+of a whole level of the tree, fetches that level with a single query &
+only then descends. Children references are resolved once every level
+has been loaded, so a subtree thaws in one query per level regardless
+of how many widgets it has."""
+from __future__ import absolute_import
+
+import cPickle
+
+from .        import statecache
+from .archive import is_stub
+from .models  import WidgetState
+
+class TreeLoader(object):
+    """Thaws trees of widgets a level at a time."""
+    def __init__(self):
+        self.widgets   = {}             # state id -> widget
+        self.pending   = []             # widgets of the level being fetched
+        self.children  = {}             # state id -> its children's ids
+        self.assembled = set()
+
+    def load(self, state_ids):
+        """Thaw the trees rooted at `state_ids', returning a dict
+        mapping each of them to its widget."""
+        self.fetch_subtrees(state_ids)
+        return dict((state_id, self.assemble(state_id))
+                    for state_id in state_ids)
+
+    def load_children(self, widget, keys):
+        """Thaw the subtrees of the children of `widget' at `keys',
+        which are still state ids."""
+        children = dict((key, widget.children[key]) for key in keys)
+        self.fetch_subtrees(children.values())
+        self.adopt(widget, children)
+
+    def fetch_subtrees(self, state_ids):
+        level = set(state_ids) - set(self.widgets)
+        while level:
+            del self.pending[:]
+            self.fetch(level)
+            level = set(state_id
+                        for widget in self.pending
+                        for state_id in widget.children.itervalues())
+            level -= set(self.widgets)
+        del self.pending[:]
+
+    def assemble(self, state_id):
+        """Return the widget for (one reference to) `state_id', with
+        its subtree. Identical states may be shared (see
+        ``Widget.freeze''), even within a tree: every reference past
+        the first gets its own copy."""
+        widget = self.widgets[state_id]
+        if state_id in self.assembled:
+            widget = statecache.copy_node(
+                widget, children=self.children[state_id])
+        else:
+            self.assembled.add(state_id)
+            self.children[state_id] = dict(widget.children)
+
+        self.adopt(widget, self.children[state_id])
+        return widget
+
+    def adopt(self, widget, children):
+        """Replace the children of `widget' given in `children' (a dict
+        of key -> state id) with their thawed widgets, restoring their
+        parent references."""
+        for key, state_id in children.iteritems():
+            child = self.assemble(state_id)
+            child.parent     = widget
+            child.parent_key = key
+            widget.children[key] = child
+
+    def fetch(self, state_ids):
+        """Fetch & unpickle one level of states, taking them from the
+        state cache when we can."""
+        missing = []
+        for state_id in state_ids:
+            node = statecache.get_node(state_id)
+            if node is None:
+                missing.append(state_id)
+            else:
+                # Cached nodes come with their children as state ids,
+                # just like freshly unpickled ones.
+                self.widgets[state_id] = node
+                self.pending.append(node)
+
+        if missing:
+            self.fetch_frozen(missing)
+
+    def fetch_frozen(self, state_ids):
+        """Fetch & unpickle states from the shared state cache, falling
+        back to the database (and sharing what we find there)."""
+        frozen = statecache.get_frozen_many(state_ids)
+        rest   = [state_id for state_id in state_ids if state_id not in frozen]
+        if rest:
+            rows = dict(WidgetState.objects.filter(pk__in=rest)
+                                           .values_list('pk', 'widget'))
+            statecache.put_frozen_many(
+                dict((state_id, value) for state_id, value in rows.iteritems()
+                                       if isinstance(value, basestring)))
+            frozen.update(rows)
+
+        missing = set(state_ids) - set(frozen)
+        if missing:
+            raise WidgetState.DoesNotExist, \
+                'No WidgetState with ids %r' % sorted(missing)
+
+        field = WidgetState._meta.get_field('widget')
+        for state_id, value in frozen.iteritems():
+            widget = field.to_python(value)
+            widget._state_id = state_id
+            self.widgets[state_id] = widget
+            self.pending.append(widget)
+            statecache.put_node(state_id, widget, frozen_size(value, widget))
+
+def frozen_size(frozen, widget):
+    """The size (in bytes) of a frozen widget, for cache accounting."""
+    if isinstance(frozen, basestring) and not is_stub(frozen):
+        return len(frozen)
+    else:
+        return len(cPickle.dumps(widget.__dict__, cPickle.HIGHEST_PROTOCOL))
+
+def thaw_children(widget, keys):
+    """Thaw the children of `widget' at `keys' (still state ids), with
+    their subtrees."""
+    TreeLoader().load_children(widget, keys)
+
+def thaw_node(frozen):
+    """Unpickle a single frozen widget (as stored in the database),
+    leaving its children as state ids."""
+    return WidgetState._meta.get_field('widget').to_python(frozen)
+
+def thaw_many(state_ids):
+    """Thaw the widgets frozen in `state_ids', returning a dict of
+    state id -> widget. This costs (at most) a single query: their
+    children are left to be thawed on first access."""
+    loader = TreeLoader()
+    loader.fetch(set(state_ids))
+    return dict((state_id, loader.widgets[state_id]) for state_id in state_ids)
+
+def thaw(state_id):
+    """Thaw the widget frozen in state `state_id' (see ``thaw_many'')."""
+    return thaw_many([state_id])[state_id]
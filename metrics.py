@@ -0,0 +1,161 @@
+"""Instrumentation of views & ajax handlers.
+
+Invocations of the handlers declared with ``@view'' & ``@ajax'' (and
+of ``Routable.__call__'', which routes to them) are measured: wall
+time, database queries, widgets frozen, and the sizes of the request &
+response. Measurements go into histograms, per widget class & handler,
+in the process-wide ``REGISTRY''; ``views.handler_stats'' shows them.
+
+Only a sample of requests is measured, at the WIDGETS_INSTRUMENT_RATE
+setting (0 turns it off): the handlers of a request are measured along
+with it, so a request is sampled as a whole. Queries are counted from
+``connection.queries'', which Django only keeps with DEBUG on."""
+from __future__ import absolute_import
+from __future__ import with_statement
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db   import connection
+
+from util.dynvar import binding, bindings
+
+RATE = getattr(settings, 'WIDGETS_INSTRUMENT_RATE', 0.01)
+
+METRICS = ('msecs', 'queries', 'freezes', 'request_bytes', 'response_bytes')
+
+class Histogram(object):
+    """Counts (non-negative) values in power-of-two buckets: bucket `i'
+    holds the values below 2**i (& at least 2**(i-1))."""
+    def __init__(self):
+        self.count   = 0
+        self.total   = 0
+        self.max     = 0
+        self.buckets = {}
+
+    def add(self, value):
+        bucket = 0
+        while (1 << bucket) <= value:
+            bucket += 1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max    = max(self.max, value)
+
+    def percentile(self, p):
+        """Return an upper bound of the `p'th percentile."""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen * 100 >= p * self.count:
+                return min(1 << bucket, self.max)
+        return 0
+
+    def summary(self):
+        return {
+            'count' : self.count,
+            'avg'   : float(self.total) / self.count if self.count else 0.0,
+            'p50'   : self.percentile(50),
+            'p90'   : self.percentile(90),
+            'p99'   : self.percentile(99),
+            'max'   : self.max,
+        }
+
+class Registry(object):
+    """The histograms of each metric, per handler."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.handlers = {}
+
+    def record(self, handler, values):
+        with self.lock:
+            histograms = self.handlers.get(handler)
+            if histograms is None:
+                histograms = self.handlers[handler] = \
+                    dict((metric, Histogram()) for metric in METRICS)
+            for metric, value in values.iteritems():
+                histograms[metric].add(value)
+
+    def summary(self):
+        """Return a dict of handler -> dict of metric -> summary."""
+        with self.lock:
+            return dict((handler, dict((metric, histogram.summary())
+                                       for metric, histogram
+                                       in histograms.iteritems()))
+                        for handler, histograms in self.handlers.iteritems())
+
+    def dump(self):
+        """Return the summary, as text."""
+        lines = []
+        for handler, metrics in sorted(self.summary().items()):
+            lines.append(handler)
+            for metric in METRICS:
+                lines.append(
+                    '  %(metric)-15s n=%(count)d avg=%(avg).1f p50=%(p50)d '
+                    'p90=%(p90)d p99=%(p99)d max=%(max)d'
+                    % dict(metrics[metric], metric=metric))
+        return '\n'.join(lines)
+
+REGISTRY = Registry()
+
+class Measurement(object):
+    def __init__(self, handler):
+        self.handler = handler
+        self.freezes = 0
+
+def count_freeze():
+    """Count a widget frozen, towards the handlers being measured."""
+    for measurement in getattr(bindings, 'measurements', None) or ():
+        measurement.freezes += 1
+
+@contextmanager
+def measure(handler, request=None):
+    """Measure the block, as an invocation of `handler' (eg.
+    'SectionWidget.ajax_save') on `request'. This yields a function
+    to call with the response, for its size. A handler measured within
+    its own measurement (see ``Page.route'') is measured once."""
+    measurements = getattr(bindings, 'measurements', None)
+    if measurements is None and not (RATE and random.random() < RATE):
+        # Not sampled, along with whatever the block measures.
+        with binding(measurements=False):
+            yield lambda response: None
+        return
+    if measurements is False or \
+            measurements and measurements[-1].handler == handler:
+        yield lambda response: None
+        return
+
+    measurement = Measurement(handler)
+    sizes   = {'response_bytes': 0}
+    queries = len(connection.queries)
+    start   = time.time()
+    def respond(response):
+        sizes['response_bytes'] = len(getattr(response, 'content', '') or '')
+
+    with binding(measurements=(measurements or ()) + (measurement,)):
+        yield respond
+
+    values = {
+        'msecs'          : int(1000 * (time.time() - start)),
+        'freezes'        : measurement.freezes,
+        'request_bytes'  : request_bytes(request),
+        'response_bytes' : sizes['response_bytes'],
+    }
+    if settings.DEBUG:
+        values['queries'] = len(connection.queries) - queries
+    REGISTRY.record(handler, values)
+
+def request_bytes(request):
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except (AttributeError, ValueError):
+        return 0
+
+def handler_of(routable, name):
+    return '%s.%s' % (routable.__class__.__name__, name)
@@ -30,7 +30,8 @@ from www.feedback.models            import Feedback
 from www.guid.resolver              import resolve_url_to_ctx
 from www.linkgraph.models           import Edge
 
-from util.django_fields import PickleField
+from .      import pagecache
+from .codec import WidgetStateField
 
 # | CATEGORIES
 #
@@ -59,12 +60,128 @@ def category_of_object(obj):
     return category_of_tag(tags[0].name) if len(tags) > 0 else None
 
 # | Widget state management.
+class WidgetStateManager(models.Manager):
+    def nth_previous(self, state_id, n):
+        """Return a tuple of (the id of the `n'th version before
+        `state_id', or None if there are fewer; the number of versions
+        before `state_id')."""
+        origin_id, version = \
+            self.filter(pk=state_id).values_list('origin', 'version')[0]
+        if version is None:
+            # Not numbered (yet, see ``number_versions'').
+            return self.walk_previous(state_id, n)
+        elif n > version:
+            return None, version
+        elif n == 0:
+            return state_id, version
+        elif n == version:
+            return origin_id, version
+
+        found = list(self.filter(origin=origin_id, version=version - n)
+                         .values_list('pk', flat=True)[:2])
+        if len(found) == 1:
+            return found[0], version
+        else:
+            # The history has branched (eg. with concurrent edits), so
+            # we have to follow the right branch.
+            return self.walk_previous(state_id, n)
+
+    def walk_previous(self, state_id, n):
+        """Like ``nth_previous'', only by following the ``previous''
+        links one by one."""
+        found, count = None, 0
+        while state_id:
+            if count == n:
+                found = state_id
+            count += 1
+            state_id = self.filter(pk=state_id)\
+                           .values_list('previous', flat=True)[0]
+        return found, count - 1
+
+    @nestable_commit_on_success
+    def number_versions(self, head_id):
+        """Number the (unnumbered) history ending at `head_id',
+        returning the number of states numbered."""
+        chain = []
+        state_id = head_id
+        while state_id:
+            previous_id, version = self.filter(pk=state_id)\
+                                       .values_list('previous', 'version')[0]
+            if version is not None:
+                break
+            chain.append(state_id)
+            state_id = previous_id
+
+        if not chain:
+            return 0
+
+        count = len(chain)
+        if state_id:
+            # Continue after the numbered part of the history.
+            origin_id, version = self.filter(pk=state_id)\
+                                     .values_list('origin', 'version')[0]
+            origin_id = origin_id or state_id
+        else:
+            origin_id, version = chain.pop(), 0
+            self.filter(pk=origin_id).update(version=0)
+
+        chain.reverse()
+        for i, chain_id in enumerate(chain):
+            self.filter(pk=chain_id).update(origin=origin_id,
+                                            version=version + i + 1)
+        return count
+
 class WidgetState(models.Model):
     """The WidgetState is a linked list of pickled widget class
     instances."""
-    widget   = PickleField()
+    widget   = WidgetStateField()
     previous = models.ForeignKey('self', null=True, blank=True)
 
+    # Identical child states are shared (see ``Widget.freeze''), and
+    # found by the digest of their contents.
+    digest   = models.CharField(max_length=40, unique=True,
+                                null=True, blank=True)
+
+    # The states of pages are numbered, so that we can find any
+    # version of a page without following the ``previous'' links:
+    # `version' counts the states before this one, all the way back to
+    # the first, `origin' (which is NULL for the first itself). These
+    # are indexed together (see migration 0010).
+    origin   = models.ForeignKey('self', null=True, blank=True,
+                                 related_name='versions')
+    version  = models.IntegerField(null=True, blank=True)
+
+    objects  = WidgetStateManager()
+
+    def __init__(self, *args, **kwargs):
+        super(WidgetState, self).__init__(*args, **kwargs)
+
+        # Widgets aren't frozen with their state id, give it back.
+        widget = self.__dict__.get('widget')
+        if self.pk is not None and hasattr(widget, '_state_id'):
+            widget._state_id = self.pk
+
+    def follow(self, previous_id):
+        """Number this new state as the version after `previous_id' (if
+        that one is numbered)."""
+        if previous_id is None:
+            self.version = 0
+            return
+
+        origin_id, version = WidgetState.objects.filter(pk=previous_id)\
+                                        .values_list('origin', 'version')[0]
+        if version is not None:
+            self.origin_id = origin_id or previous_id
+            self.version   = version + 1
+
+def coordinates_of_page(page):
+    """Return the (latitude, longitude) of `page' as floats (pages
+    keep them as strings), or (None, None) if it has none."""
+    try:
+        return float(page.latitude), float(page.longitude)
+    except (AttributeError, TypeError, ValueError):
+        return None, None
+
 # | Wiki router.
 #
 # Any router maps a prefix to a page. The page itself is responsible
@@ -239,6 +356,12 @@ class WikiPage(models.Model):
     title           = models.CharField(max_length=500)
     tokens          = models.TextField()
 
+    # Where the page is, for maps of the pages linking to it (see
+    # ``OneColumnPage.render_map_points''). These are indexed together
+    # (see migration 0011).
+    latitude        = models.FloatField(null=True, blank=True)
+    longitude       = models.FloatField(null=True, blank=True)
+
     objects = WikiPageManager()
 
     class Meta:
@@ -255,7 +378,8 @@ class WikiPage(models.Model):
         # delicate, but it simplifies other aspects of operation, and
         # decouples the widget from the actual route & head state
         # management.
-        w = self.head.widget
+        from .loader import thaw
+        w = thaw(self.head_id)
         w.delegate = self
         return w
 
@@ -355,12 +479,14 @@ class WikiPage(models.Model):
             self.wiki.save()
 
         # Set the current state to our wiki.
+        old_head_id = self.head_id
         self.head = WidgetState.objects.get(pk=widget.get_state_id())
 
         # Denormalize needed fields:
         self.modified_on  = widget.edit_time
         self.title        = widget.title
         self.tokens       = ' '.join(widget.tokens())
+        self.latitude, self.longitude = coordinates_of_page(widget)
         
         if not self.created_at:
             self.created_at = widget.edit_time
@@ -372,6 +498,7 @@ class WikiPage(models.Model):
                 self.created_from_ip = widget.edit_ip_address
 
         self.save()
+        pagecache.invalidate(old_head_id, self.head_id)
 
         # After save, we update the category, since it needs a saved
         # object (pk) and invalidate the category cache for the wiki.
@@ -417,7 +544,8 @@ class WikiPage(models.Model):
         
 
     def notify_followers_post_save(self, widget):
-        prev = self.head.previous.widget if self.head.previous else None
+        from .loader import thaw
+        prev = thaw(self.head.previous_id) if self.head.previous_id else None
         if (prev and widget.edit_user and prev.edit_user == widget.edit_user
               and widget.edit_time - prev.edit_time < timedelta(minutes=30)):
             # Don't notify adjacent edits within 30 minutes from the same user
@@ -520,24 +648,28 @@ class WikiPageChange(models.Model):
         if not self.state:
             return
         
-        # Walk the linked list of versions from the head (latest) earlier.
-        state = self.page.head
+        # Walk the linked list of versions from the head (latest)
+        # earlier. We only follow the links, and thaw just the version
+        # we revert to.
+        from .loader import thaw
+        state_id = self.page.head_id
         found_self = False
-        while state:
-            change = get_or_none(WikiPageChange.objects, state=state)
+        while state_id:
+            change = get_or_none(WikiPageChange.objects, state=state_id)
             visible = (not change.is_hidden_change) if change else True
-            found_self = found_self or state == self.state
+            found_self = found_self or state_id == self.state_id
             if visible:
                 if not found_self:
                     # A later version is visible, don't make a revert version.
                     return
-                if found_self and state != self.state:
+                if found_self and state_id != self.state_id:
                     # An earlier visible version exists, use it for the revert.
                     break
-            state = state.previous
+            state_id = WidgetState.objects.filter(pk=state_id)\
+                                          .values_list('previous', flat=True)[0]
 
-        if state:
-            old_page = state.widget
+        if state_id:
+            old_page = thaw(state_id)
         else:
             from .page import OneColumnPage
             old_page = OneColumnPage(self.page)
@@ -1,11 +1,16 @@
 """Page widgets are usually at the root of the widget hierarchy, and
 is composed of other widgets."""
 from __future__ import absolute_import
+from __future__ import with_statement
 
 from datetime import datetime
 from itertools import ifilter
+import hashlib
 import re
+import time
 
+from django.conf                import settings as django_settings
+from django.core.cache          import cache
 from django.contrib.auth.models import User
 from django.core.urlresolvers   import resolve
 from django.http                import HttpResponse, Http404
@@ -26,9 +31,12 @@ from util.dynvar              import bindings
 from util.seq                 import nonrepeated
 from util.functional          import pick, assoc, rassoc
 
-from .widget import Widget
-from .router import view, ajax, render_to_string_with_namespace
-from .models import WikiPage
+from .        import fragments
+from .widget  import Widget, coalesced, freeze_session
+from .metrics import handler_of, measure
+from .router  import view, ajax, etag_of, render_to_string_with_namespace
+from .models  import WikiPage, WidgetState
+from .loader  import thaw
 
 class NeedsAuthentication(Exception): pass
 
@@ -37,6 +45,75 @@ class NeedsCaptcha(Exception): pass
 # used to replace urls like '/../place.html' with '/place.html' 
 SLASH_DOTS_RE = re.compile(r'^/\.\.(?=/)')
 
+# | Listings on maps.
+#
+# The listings a page links to are looked up in the cache all at once,
+# and only those missing from it in the ``ListingTable''. We keep only
+# what maps need, for those with coordinates (& an empty tuple for the
+# others, which aren't listings or can't be placed). Those others may
+# become listings any time, so they are only kept for a short while (0
+# doesn't keep them).
+LISTING_TIMEOUT = getattr(django_settings, 'WIDGETS_LISTING_CACHE_TIMEOUT',
+                          60*60)
+LISTING_NEGATIVE_TIMEOUT = getattr(
+    django_settings, 'WIDGETS_LISTING_NEGATIVE_CACHE_TIMEOUT', 60)
+
+def key_of_listing_guid(guid):
+    if isinstance(guid, unicode):
+        guid = guid.encode('utf-8')
+    return 'widgets_listing:' + hashlib.sha1(guid).hexdigest()
+
+def located_listings(guids):
+    """Return a dict of guid -> (name, address, latitude, longitude)
+    of those of `guids' that are listings with coordinates."""
+    keys   = dict((key_of_listing_guid(guid), guid) for guid in set(guids))
+    cached = cache.get_many(keys.keys())
+
+    located = {}
+    for key, guid in keys.iteritems():
+        listing = cached.get(key)
+        if listing is None:
+            listing = ListingTable.get_by_guid(guid)
+            if listing and listing.latitude and listing.longitude:
+                listing = (listing.name, listing.address_line,
+                           listing.latitude, listing.longitude)
+                cache.set(key, listing, LISTING_TIMEOUT)
+            else:
+                listing = ()
+                if LISTING_NEGATIVE_TIMEOUT:
+                    cache.set(key, listing, LISTING_NEGATIVE_TIMEOUT)
+        if listing:
+            located[guid] = listing
+    return located
+
+# | Entity tags.
+#
+# A page & its previous versions are functions of the head state (and
+# of who is looking), except for the reviews shown on the page itself,
+# which change without a freeze: its entity tags only hold for so long.
+# Conditional GETs of pages are answered by ``views.wiki_page'', from
+# the ``WikiPage'' head, before anything is thawed (so pages don't
+# answer them again, see ``Routable.etag'').
+ROOT_ETAG_PERIOD = getattr(django_settings, 'WIDGETS_ROOT_ETAG_PERIOD', 60*5)
+
+PREV_RE = re.compile(r'^-(\d+)')
+
+def etag_of_page(request, head_id, path):
+    """Return the entity tag of a GET of `path' on the page whose
+    head is `head_id', or None if it has none. This needs nothing
+    thawed."""
+    user_id   = getattr(request.user, 'pk', None)
+    full_path = request.get_full_path()
+    if path == '':
+        return etag_of(head_id, user_id, full_path,
+                       int(time.time()) // ROOT_ETAG_PERIOD)
+
+    match = PREV_RE.match(path)
+    if match:
+        return etag_of(head_id, user_id, full_path, int(match.group(1)))
+
+    return None
+
 class Page(Widget):
     def __init__(self, delegate):
         super(Page, self).__init__()
@@ -68,6 +145,19 @@ class Page(Widget):
     def wiki(self):
         return self._delegate.wiki
 
+    def route(self, request, path):
+        # Whatever a request changes is frozen once, as it completes
+        # (and before ``request'' goes away: we need it to freeze). That
+        # is measured as part of the handler the request is for.
+        view, args, kwargs = self.dispatch(path)
+        handler = handler_of(view.im_self, view.__name__)
+        with measure(handler, request) as respond:
+            with freeze_session():
+                response = view(request, *args, **kwargs)
+            respond(response)
+        return response
+
+    @coalesced
     def freeze(self):
         transcoding = getattr(bindings, 'transcoding', None)
         if transcoding:
@@ -110,10 +200,16 @@ class Page(Widget):
     # | Reversing is special for root widgets.
     #
     # `Page' is routed by a WikiPage, so we reverse it to a view that
-    # knows how to route those, and thaw the page object.
-    def reverse(self, view, *args, **kwargs):
-        return self.delegate.reverse(
-            super(Page, self).reverse(view, *args, **kwargs))
+    # knows how to route those, and thaw the page object. That is done
+    # once per delegate, as long as it isn't renamed (or moved).
+    @property
+    def url_prefix(self):
+        delegate = self.delegate
+        key  = delegate, delegate.wiki_id, delegate.slug
+        memo = getattr(self, '_url_prefix', None)
+        if memo is None or memo[0] is not delegate or memo[1:3] != key[1:]:
+            memo = self._url_prefix = key + (delegate.reverse(''),)
+        return memo[3]
 
     def __getstate__(self):
         # Never store the delegate reference. This is always restored
@@ -168,19 +264,16 @@ class Page(Widget):
     @view(r'^-(?P<prev_num>\d+)', 'prev')
     def prev(self, request, prev_num):
         prev_num = int(prev_num)
-        count = 0
-        widget_state = self.get_state_object()
-        old_widget = None
-        while widget_state:
-            if count == prev_num:
-                old_widget = widget_state.widget
-                old_widget.delegate = self.delegate
-            count += 1
-            widget_state = widget_state.previous            
-        if not old_widget:
+        state_id, count = WidgetState.objects.nth_previous(
+            self.get_state_id(), prev_num)
+        if not state_id:
             raise Http404
+
+        # Only the version we render is thawed.
+        old_widget = thaw(state_id)
+        old_widget.delegate = self.delegate
         return HttpResponse(old_widget.render_previous_as_readonly(
-                            prev_num, count - 1))
+                            prev_num, count))
 
     # | Helpers for rendering templates.
     @property
@@ -227,7 +320,8 @@ class OneColumnPage(Page):
 
     @property
     def ordered(self):
-        return [self[i] for i in self.order]
+        children = self.thawed_children(self.order)
+        return [children[i] for i in self.order]
 
     def render_widget(self, widget, **kwargs):
         which = kwargs.pop('which', 'render')
@@ -248,10 +342,31 @@ class OneColumnPage(Page):
                                   template='widgets/_widget_readonly.html',
                                   **kwargs)
 
+    def render_widgets(self, widgets, template='widgets/_widget.html'):
+        """Render `widgets' (in view mode), taking what we can from the
+        fragment cache, and caching the rest."""
+        page_url = self.url_prefix
+        keys     = [fragments.key_of_widget(widget, template, page_url)
+                    for widget in widgets]
+        cached   = fragments.get_many(filter(None, keys))
+
+        rendered, missed = [], {}
+        for widget, key in zip(widgets, keys):
+            fragment = cached.get(key)
+            if fragment is None:
+                fragment = self.render_widget(widget, template=template)
+                if key:
+                    missed[key] = fragment
+            rendered.append(fragment)
+
+        fragments.put_many(missed)
+        return rendered
+
     def base_template_and_context(self, base_template):
         """Defines the base template w/ its appropriate context."""
         title   = 'Untitled' if not self.title else self.title
-        widgets = zip(self.ordered, map(self.render_widget, self.ordered))
+        ordered = self.ordered
+        widgets = zip(ordered, self.render_widgets(ordered))
         return 'widgets/onecolumn.html', {
             'addables'           : pick(0, self.WIDGETS),
             'widgets'            : widgets,
@@ -282,7 +397,8 @@ class OneColumnPage(Page):
     def render_readonly(self):
         """Render a version of onecolumn as a snippet of formatted html."""
         title   = 'Untitled' if not self.title else self.title
-        contents = ''.join(map(self.render_widget_readonly, self.ordered))
+        contents = ''.join(self.render_widgets(
+            self.ordered, template='widgets/_widget_readonly.html'))
 
         return django_render_to_string('widgets/onecolumn_readonly.html',
                                        dict(title=title, contents=contents))
@@ -356,29 +472,26 @@ class OneColumnPage(Page):
         uris = [SLASH_DOTS_RE.sub('', u) for u in uris if u.startswith('/')]
 
         # Add business listings
+        guids    = [uri[1:] for uri in uris if '/' not in uri[1:]]
+        listings = located_listings(guids)
         for uri in uris:
-            guid = uri[1:]
-            if '/' in guid:
-                # Non-listing link
-                continue
-            listing = ListingTable.get_by_guid(guid)
-            if not listing:
-                # Not a GUID
-                continue
-            if not listing.latitude or not listing.longitude:
-                # No latitude/longitude
+            listing = listings.get(uri[1:])
+            if listing is None:
+                # Not a GUID, or no latitude/longitude
                 continue
+            name, address, latitude, longitude = listing
             point = {'type'    : '',
-                     'name'    : conditional_escape(listing.name),
+                     'name'    : conditional_escape(name),
                      'url'     : uri,
-                     'address' : listing.address_line,
-                     'lat'     : listing.latitude,
-                     'lon'     : listing.longitude}
+                     'address' : address,
+                     'lat'     : latitude,
+                     'lon'     : longitude}
             map_points.append(point)
 
         # Add wiki pages
         from .views import wiki_page as wiki_page_view # cyclic dependency
         self_wiki_slug = self.delegate.wiki.slug
+        uris_of_slugs  = {}
         for uri in uris:
             try:
                 view, _, kwargs = resolve(uri)
@@ -388,29 +501,31 @@ class OneColumnPage(Page):
             if view != wiki_page_view:
                 # Not a wiki page
                 continue
-            page_slug = kwargs['page_slug']
-            wiki_slug = kwargs['wiki_slug']
-            if wiki_slug != self_wiki_slug:
+            if kwargs['wiki_slug'] != self_wiki_slug:
                 # Skip if in different wiki home
                 continue
-            try:
-                wiki_page = WikiPage.objects.get(slug=page_slug,
-                                                 wiki__slug=wiki_slug)
-            except WikiPage.DoesNotExist:
-                # Non-existant WikiPage
-                continue
-            if wiki_page == self.delegate:
-                # Ignore self
-                continue
-            if not wiki_page.page.latitude or not wiki_page.page.longitude:
+            uris_of_slugs.setdefault(kwargs['page_slug'], []).append(uri)
+
+        # Pages keep their coordinates (see ``WikiPage.latitude''), so
+        # that none of them has to be thawed.
+        linked = WikiPage.objects.filter(
+            wiki__slug=self_wiki_slug, slug__in=uris_of_slugs.keys())\
+            .exclude(latitude=None).exclude(longitude=None)
+        if self.delegate.pk is not None:
+            # Ignore self
+            linked = linked.exclude(pk=self.delegate.pk)
+        for slug, title, latitude, longitude in linked.values_list(
+                'slug', 'title', 'latitude', 'longitude'):
+            if not latitude or not longitude:
                 # No latitude/longitude
                 continue
-            point = {'type' : '',
-                     'name' : conditional_escape(wiki_page.page.title),
-                     'url'  : uri,
-                     'lat'  : wiki_page.page.latitude,
-                     'lon'  : wiki_page.page.longitude}
-            map_points.append(point)
+            for uri in uris_of_slugs[slug]:
+                point = {'type' : '',
+                         'name' : conditional_escape(title),
+                         'url'  : uri,
+                         'lat'  : latitude,
+                         'lon'  : longitude}
+                map_points.append(point)
 
         return map_points
 
@@ -458,6 +573,36 @@ class OneColumnPage(Page):
             self.freeze()
         return {}
 
+    @ajax('batch')
+    def batch(self, **fields):
+        """Make many ajax calls at once, returning the list of their
+        results. Call `i' is posted as the field `i' (the namespace of
+        its widget & the name of its handler, separated by a space),
+        along with its arguments as `i.argument'. The calls share our
+        request, so that whatever they change is frozen once, in a
+        single transaction. Malformed calls are a 404."""
+        calls = {}
+        for field, value in fields.iteritems():
+            i, _, argument = field.partition('.')
+            if not i.isdigit():
+                raise Http404, 'Malformed batch field %r' % field
+            call = calls.setdefault(int(i), [None, None, {}])
+            if argument:
+                call[2][argument] = value
+            elif ' ' in value:
+                call[0], call[1] = value.split(' ', 1)
+            else:
+                raise Http404, 'Malformed call %r: %r' % (field, value)
+
+        results = []
+        for i in sorted(calls):
+            namespace, name, kwargs = calls[i]
+            if namespace is None:
+                raise Http404, 'Call %d has no handler' % i
+            widget = self.widget_of_namespace(namespace)
+            results.append(widget.call_ajax(name, kwargs) or '')
+        return results
+
     @ajax('get-edit-info')
     def get_edit_info(self):
         return django_render_to_string(
@@ -0,0 +1,140 @@
+"""Caching of whole pages for anonymous readers.
+
+Most requests are logged-out readers of the head of a page (see
+``views.wiki_page''), and what they get back depends on little more
+than the head state (``WikiPage.head'') & the URL. Responses to them
+are cached by head state id: a new head makes for new keys, and
+``WikiPage.freeze'' drops what was cached for the old one.
+
+All the variants of a page (the request headers named by the
+WIDGETS_PAGE_CACHE_VARY setting) are kept together, under one key per
+head. Parts of a page that change without a freeze (reviews, comments)
+may be stale for up to WIDGETS_PAGE_CACHE_TIMEOUT seconds, so it is
+kept short.
+
+Once a page changes, all of its readers miss at once. Only the first
+one renders the page: the others wait (for up to
+WIDGETS_PAGE_CACHE_WAIT seconds) for it to be cached. Hits & misses
+are counted in ``STATS''.
+
+The cache is opt-in, behind the same pluggable backends as the shared
+state cache: set WIDGETS_PAGE_CACHE (eg. 'memcached://host:11211/', or
+'locmem://' for tests & development)."""
+from __future__ import absolute_import
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .statecache import backend_of_uri
+
+# The configured backend, if any.
+PAGES = None
+if getattr(settings, 'WIDGETS_PAGE_CACHE', None):
+    PAGES = backend_of_uri(settings.WIDGETS_PAGE_CACHE)
+
+TIMEOUT = getattr(settings, 'WIDGETS_PAGE_CACHE_TIMEOUT', 60*5)
+VARY    = getattr(settings, 'WIDGETS_PAGE_CACHE_VARY', ('HTTP_HOST',))
+
+# How long to wait for another request to render a page, & how often
+# to look whether it has.
+WAIT      = getattr(settings, 'WIDGETS_PAGE_CACHE_WAIT', 2.0)
+WAIT_STEP = 0.05
+
+class PageCacheStats(object):
+    """Counts lookups, by outcome: hits, hits after waiting for another
+    request to render, misses, & requests that can't be cached."""
+    OUTCOMES = ('hit', 'wait', 'miss', 'bypass')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = dict.fromkeys(self.OUTCOMES, 0)
+
+    def record(self, outcome):
+        self.counts[outcome] += 1
+
+    def summary(self):
+        """Return a dict of the counts, along with the `hit_rate' of
+        the lookups that could be cached."""
+        summary = dict(self.counts)
+        lookups = summary['hit'] + summary['wait'] + summary['miss']
+        hits    = summary['hit'] + summary['wait']
+        summary['hit_rate'] = float(hits) / lookups if lookups else 0.0
+        return summary
+
+STATS = PageCacheStats()
+
+def key_of_head_id(head_id):
+    return 'widgets_page:%d' % head_id
+
+def variant_of_request(request):
+    return hashlib.sha1('\0'.join(
+        [request.path] + [request.META.get(name, '') for name in VARY])
+    ).hexdigest()
+
+def is_cacheable(request, rest):
+    """Only anonymous plain GETs of the page itself are cached."""
+    return (PAGES is not None and rest == '' and request.method == 'GET'
+            and not request.GET and request.user.is_anonymous())
+
+def response_of_entry(entry, outcome):
+    status, content_type, content = entry
+    response = HttpResponse(content, content_type=content_type, status=status)
+    response['X-Widgets-Page-Cache'] = outcome
+    return response
+
+def cached_response(request, wikipage, rest, respond):
+    """Return the response to `request' for `rest' of `wikipage', from
+    the cache if possible, calling `respond' otherwise."""
+    if not is_cacheable(request, rest):
+        STATS.record('bypass')
+        return respond()
+
+    key     = key_of_head_id(wikipage.head_id)
+    variant = variant_of_request(request)
+    entry   = PAGES.get_many([key]).get(key, {}).get(variant)
+    if entry is not None:
+        STATS.record('hit')
+        return response_of_entry(entry, 'hit')
+
+    # Someone else may be rendering the page already.
+    lock   = '%s:%s:lock' % (key, variant)
+    locked = PAGES.add(lock, 1, int(WAIT) + 1)
+    if not locked:
+        waited = 0.0
+        while waited < WAIT:
+            time.sleep(WAIT_STEP)
+            waited += WAIT_STEP
+            entry = PAGES.get_many([key]).get(key, {}).get(variant)
+            if entry is not None:
+                STATS.record('wait')
+                return response_of_entry(entry, 'wait')
+
+    STATS.record('miss')
+    try:
+        response = respond()
+        if response.status_code == 200 and not response.cookies:
+            # Variants are few: we don't mind the odd lost update.
+            variants = dict(PAGES.get_many([key]).get(key, {}))
+            variants[variant] = (response.status_code,
+                                 response['Content-Type'], response.content)
+            PAGES.set_many({key: variants}, TIMEOUT)
+    finally:
+        if locked:
+            PAGES.delete(lock)
+
+    response['X-Widgets-Page-Cache'] = 'miss'
+    return response
+
+def invalidate(*head_ids):
+    """Forget about the pages cached for the heads `head_ids'."""
+    if PAGES is None:
+        return
+
+    for head_id in head_ids:
+        if head_id:
+            PAGES.delete(key_of_head_id(head_id))
@@ -2,6 +2,9 @@
 methods. The ``Routable'' sets up the basics of URL routing, while
 ``Widget'' in ``widget.py'' sets widgets up in a tree of Routables
 that can route URLs through the widget hierarchy."""
+from __future__ import with_statement
+
+import hashlib
 import inspect
 import cjson
 import re
@@ -12,13 +15,18 @@ from django.template.loader    import find_template_source, render_to_string
 from django.conf.urls.defaults import patterns, url
 from django.http               import (HttpResponse,
                                        HttpResponseNotAllowed,
+                                       HttpResponseNotModified,
                                        Http404)
-from django.template           import Template, Context
+from django.template           import Template, Context, TextNode, NodeList
+from django.conf               import settings
 
-from util.functional import pick, memoize_
+from util.functional import pick
 from util.coerce     import coerce
 from util.digest     import pydigest_str
 
+from .statecache import LRUCache
+from .metrics    import handler_of, measure
+
 # | Resolution & routing.
 class Resolver(RegexURLResolver):
     """Wrapper around Django's URL resolver to make it more convenient
@@ -30,19 +38,33 @@ class Resolver(RegexURLResolver):
         self.urlpatterns     = patterns('', *pairs)
         self._urlconf_module = self
 
+# class -> ``Resolver'' of its views (see ``Routable.routes'')
+ROUTES = {}
+
+# (class, view) -> the URL of a view without arguments
+REVERSED = {}
+
 class Routable(object):
     """The routable class provides members decorated with ``@view'' or
     ``@ajax'' with a routable URL namespace, and the means by which to
     call into the defined views (via __call__ -- ie. Routables are
     callable())"""
-    def _resolver(self):
-        views = inspect.getmembers(self, lambda m: hasattr(m, '_urlpattern'))
-        views = pick(1, views)
-        pairs = []
-        for view in views:
-            pairs.append(url(view._urlpattern, view, name=view._viewname))
-
-        return Resolver(*pairs)
+    @classmethod
+    def routes(cls):
+        """The resolver of the views of the class, built on first use
+        & shared by all its instances. Its views are plain functions,
+        bound to the instance by ``resolve''."""
+        resolver = ROUTES.get(cls)
+        if resolver is None:
+            views = inspect.getmembers(
+                cls, lambda m: hasattr(m, '_urlpattern'))
+            pairs = []
+            for view in pick(1, views):
+                fun = getattr(view, 'im_func', view)
+                pairs.append(url(fun._urlpattern, fun, name=fun._viewname))
+
+            resolver = ROUTES[cls] = Resolver(*pairs)
+        return resolver
 
     @property
     def request(self):
@@ -50,26 +72,70 @@ class Routable(object):
         return getattr(self, '_request', None)
 
     def __call__(self, request, path):
-        """Route the given request & path, calling the view."""
+        """Route the given request & path, calling the view. GETs of
+        views with an ``etag'' are conditional."""
+        etag = None
+        # (Widgets can be routed with bare requests, eg. in tests.)
+        if getattr(request, 'method', None) in ('GET', 'HEAD'):
+            etag = self.etag(request, path)
+            if etag is not None and is_not_modified(request, etag):
+                return not_modified(etag)
+
         self._request = request
         try:
-            view, args, kwargs = self.resolve(path)
-            return view(request, *args, **kwargs)
+            with measure(handler_of(self, '__call__'), request) as respond:
+                response = self.route(request, path)
+                respond(response)
         finally:
             del self._request
 
+        if etag is not None and response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+    def etag(self, request, path):
+        """Return the entity tag (see ``etag_of'') of the response to a
+        GET of `path', if it can be had without routing, or None."""
+        return None
+
+    def route(self, request, path):
+        """Resolve `path' & call the view (with ``request'' set)."""
+        view, args, kwargs = self.resolve(path)
+        return view(request, *args, **kwargs)
+
     def resolve(self, path):
-        return self._resolver().resolve(path)
+        view, args, kwargs = self.routes().resolve(path)
+        return view.__get__(self, self.__class__), args, kwargs
 
     def reverse(self, view, *args, **kwargs):
         """Reverse the view (or view name) with the given arguments on
         this object."""
-        return self._resolver().reverse(view, *args, **kwargs)
+        # Views are routed by their function.
+        view = getattr(view, 'im_func', view)
+        if args or kwargs:
+            return self.routes().reverse(view, *args, **kwargs)
+
+        # Views without arguments (eg. ajax handlers) always reverse
+        # the same.
+        key      = self.__class__, view
+        fragment = REVERSED.get(key)
+        if fragment is None:
+            fragment = REVERSED[key] = self.routes().reverse(view)
+        return fragment
 
     def reverse_ajax(self, name):
         """Reverse the given named ajax handler."""
         return self.reverse('ajax_%s' % name)
 
+    def call_ajax(self, name, kwargs):
+        """Call the named ajax handler with the dict `kwargs' (of the
+        fields it would be posted), returning its result unencoded."""
+        view, args, _ = self.resolve('_ajax/%s' % name)
+        call = getattr(view, '_call', None)
+        if call is None:
+            raise Http404, 'No ajax handler %r' % name
+        return call(self, kwargs)
+
     def __getstate__(self):
         dict = self.__dict__.copy()
         # Never serialize _request, it's ephemeral.
@@ -78,41 +144,73 @@ class Routable(object):
 
         return dict
 
+# | Conditional GETs.
+def etag_of(*parts):
+    """Return a strong entity tag for a response that depends on
+    nothing but `parts' (state ids, & the like)."""
+    return '"%s"' % hashlib.sha1(' '.join(map(str, parts))).hexdigest()
+
+def is_not_modified(request, etag):
+    tags = request.META.get('HTTP_IF_NONE_MATCH')
+    if not tags:
+        return False
+    tags = [tag.strip() for tag in tags.split(',')]
+    return etag in tags or '*' in tags
+
+def not_modified(etag):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
 # | Decorators
 def view(pattern, name=None):
     """The view decorator declares the member function a view, with a
     URL pattern defined as an arguent."""
     def decorate(fun):
-        fun._urlpattern = pattern
-        fun._viewname   = name
-        return fun
+        def measured(self, request, *args, **kwargs):
+            with measure(handler_of(self, fun.__name__), request) as respond:
+                response = fun(self, request, *args, **kwargs)
+                respond(response)
+            return response
+
+        measured.__name__    = fun.__name__
+        measured.__doc__     = fun.__doc__
+        measured._urlpattern = pattern
+        measured._viewname   = name
+        return measured
 
     return decorate
 
 def ajax(name, encode=True):
     """The ajax decorator declares the method an ajax handler with the
-    given name."""
+    given name. Handlers can also be called directly, with the fields
+    they would be posted (see ``Routable.call_ajax'')."""
     def decorate(fun):
+        def call(self, kwargs):
+            return fun(self, **coerce(kwargs, unicode, str))
+
         def handler(self, request):
             if request.method != 'POST':
                 return HttpResponseNotAllowed(['POST'])
 
-            # JSON-decode kwargs and return the results JSON-encoded 
-            kwargs = dict(request.POST.items())
-            kwargs = coerce(kwargs, unicode, str)
-
-            # Make the response & decorate it so that we don't get log
-            # messages (from djangologging).
-            response = fun(self, **kwargs)
-            if encode:
-                response = cjson.encode(response or '')
-
-            response = HttpResponse(response)
-            setattr(response, SUPPRESS_OUTPUT_ATTR, True)
+            with measure(handler_of(self, handler.__name__),
+                         request) as respond:
+                # JSON-decode kwargs and return the results JSON-encoded 
+                response = call(self, dict(request.POST.items()))
+                if encode:
+                    response = cjson.encode(response or '')
+
+                # Make the response & decorate it so that we don't get
+                # log messages (from djangologging).
+                response = HttpResponse(response)
+                setattr(response, SUPPRESS_OUTPUT_ATTR, True)
+                respond(response)
             return response
 
+        handler.__name__    = 'ajax_%s' % name
         handler._urlpattern = r'^_ajax/%s' % name
         handler._viewname   = 'ajax_%s' % name
+        handler._call       = call
 
         return handler
 
@@ -139,21 +237,156 @@ def render_template_with_namespace(fun):
 
     return decorated
 
+# | Namespaced templates.
+#
+# Namespaced templates are compiled once, as they are: the namespaces
+# only ever appear in literal text (never within tags), which renders
+# through ``NamespacedTextNode''s that substitute them from the
+# context.
+NAMESPACES = 'widgets.namespaces'       # (can't be looked up by templates)
+
+# Whether to check templates for changes on every render (in
+# development).
+RELOAD_TEMPLATES = getattr(settings, 'WIDGETS_RELOAD_TEMPLATES',
+                           settings.TEMPLATE_DEBUG)
+
+class NamespacedTextNode(TextNode):
+    def __init__(self, s):
+        super(NamespacedTextNode, self).__init__(s)
+        self.plan = SplicePlan(s)
+
+    def render(self, context):
+        return self.plan.splice(*context[NAMESPACES])
+
+def namespace_nodes(nodelist):
+    """Replace the text nodes holding namespaces in `nodelist' (and
+    the nodelists of its nodes, recursively)."""
+    for i, node in enumerate(nodelist):
+        if isinstance(node, TextNode):
+            if '__' in node.s:
+                nodelist[i] = NamespacedTextNode(node.s)
+        else:
+            for value in node.__dict__.itervalues():
+                if isinstance(value, NodeList):
+                    namespace_nodes(value)
+
+# template name -> (source, compiled template)
+TEMPLATES = {}
+
+def namespaced_template(template_name):
+    compiled = TEMPLATES.get(template_name)
+    if compiled is None or RELOAD_TEMPLATES:
+        source, origin = find_template_source(template_name)
+        if compiled is None or compiled[0] != source:
+            template = Template(source, origin, template_name)
+            namespace_nodes(template.nodelist)
+            compiled = TEMPLATES[template_name] = source, template
+
+    return compiled[1]
+
+def invalidate_templates():
+    """Forget about the compiled namespaced templates."""
+    TEMPLATES.clear()
+
+# (protected namespace + template name) -> private namespace
+PRIVATE_NAMESPACES = LRUCache(
+    getattr(settings, 'WIDGETS_PRIVATE_NAMESPACE_CACHE_SIZE', 4096))
+
+def private_namespace(protected_ns, template_name):
+    key        = protected_ns + template_name
+    private_ns = PRIVATE_NAMESPACES.get(key)
+    if private_ns is None:
+        private_ns = '_' + pydigest_str(key)
+        PRIVATE_NAMESPACES.put(key, private_ns, 1)
+    return private_ns
+
 def render_to_string_with_namespace(
         protected_ns, template_name,
         dictionary=None, context_instance=None):
-    source, origin = find_template_source(template_name)
-    private_ns     = '_' + memoize_(pydigest_str, protected_ns + template_name)
-    source         = subns(protected_ns, private_ns, source)
-
-    template = Template(source, origin, template_name)
+    private_ns = private_namespace(protected_ns, template_name)
+    template   = namespaced_template(template_name)
 
     if context_instance:
         context_instance.update(dictionary)
     else:
         context_instance = Context(dictionary)
 
-    return template.render(context_instance)
+    context_instance.push()
+    try:
+        context_instance[NAMESPACES] = protected_ns, private_ns
+        return template.render(context_instance)
+    finally:
+        context_instance.pop()
+
+# | Splicing namespaces.
+#
+# ``subns()'' substitutes namespaces in two passes: private ones for
+# '___', then protected ones for '__' -- including the '__'s that span
+# the private namespaces substituted (which begin & end with a '_').
+# A ``SplicePlan'' works out where the namespaces go in a given text
+# once, so that the same output is spliced together with a single
+# join.
+PROTECTED = None                        # (stands for the protected namespace)
+
+def scan(text, pending):
+    """Split `text' on '__' as the second pass of ``subns()'' would, in
+    parts of text & ``PROTECTED''. `pending' tells whether the text
+    before ended with a lone '_', which may pair with our first. This
+    returns the parts, and whether we end with a lone '_' ourselves
+    (which isn't in the parts)."""
+    if not text:
+        return [], pending
+
+    parts, start = [], 0
+    if pending:
+        if text[0] == '_':
+            parts.append(PROTECTED)
+            start = 1
+        else:
+            parts.append('_')
+
+    while True:
+        i = text.find('__', start)
+        if i < 0:
+            break
+        if i > start:
+            parts.append(text[start:i])
+        parts.append(PROTECTED)
+        start = i + 2
+
+    rest = text[start:]
+    pending = rest.endswith('_')
+    if pending:
+        rest = rest[:-1]
+    if rest:
+        parts.append(rest)
+    return parts, pending
+
+class SplicePlan(object):
+    """The namespacing of `text', as by ``subns()''."""
+    def __init__(self, text):
+        # For each piece between private namespaces, its parts when
+        # following a lone '_' or not.
+        self.pieces = [(scan(piece, False), scan(piece, True))
+                       for piece in text.split('___')]
+
+    def splice(self, protected_ns, private_ns):
+        protected = protected_ns + '_'
+        private   = (scan(private_ns + '_', False),
+                     scan(private_ns + '_', True))
+
+        parts, pending = [], False
+        for i, piece in enumerate(self.pieces):
+            if i:
+                more, pending = private[pending]
+                parts.extend(more)
+            more, pending = piece[pending]
+            parts.extend(more)
+        if pending:
+            parts.append('_')
+
+        return ''.join([part is PROTECTED and protected or part
+                        for part in parts])
 
 def subns(protected_ns, private_ns, content):
     """Substitute private & protected namespaces in the given content
@@ -0,0 +1,260 @@
+"""Caching of widget states.
+
+A ``WidgetState'' never changes once it has been created, so there is
+no need to fetch & unpickle the same state over & over again. There
+are two tiers, both keyed by state id:
+
+  - A bounded, process-local LRU of thawed widgets. Cached widgets are
+    *nodes*: their children are still state ids, to be resolved by the
+    ``TreeLoader''. Since widgets are mutable, the cache never hands
+    out the objects it holds, only copies of them.
+
+  - A cache of frozen states (as stored in the database) shared by all
+    processes, behind a pluggable backend configured by the
+    WIDGETS_SHARED_STATE_CACHE setting (eg. 'memcached://host:11211/',
+    or 'locmem://' for tests). Since states are immutable, entries
+    live long."""
+from __future__ import absolute_import
+from __future__ import with_statement
+
+import threading
+from copy import deepcopy
+
+from django.conf import settings
+
+class LRUCache(object):
+    """A bounded, thread-safe LRU mapping. Each entry is accounted for
+    with its (approximate) size in bytes, and the least recently used
+    entries are evicted once the total exceeds `max_bytes'."""
+    PREV, NEXT, KEY, VALUE, SIZE = range(5)
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock      = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # A circular doubly-linked list of entries, most recently
+            # used first.
+            self.root      = []
+            self.root[:]   = [self.root, self.root, None, None, 0]
+            self.entries   = {}
+            self.bytes     = 0
+            self.hits      = 0
+            self.misses    = 0
+            self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._unlink(entry)
+            self._link(entry)
+            return entry[self.VALUE]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+                self.bytes -= entry[self.SIZE]
+
+            entry = [None, None, key, value, size]
+            self._link(entry)
+            self.entries[key] = entry
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                lru = self.root[self.PREV]
+                self._unlink(lru)
+                del self.entries[lru[self.KEY]]
+                self.bytes     -= lru[self.SIZE]
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+                self.bytes -= entry[self.SIZE]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries'   : len(self.entries),
+            'bytes'     : self.bytes,
+            'max_bytes' : self.max_bytes,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions,
+            'hit_rate'  : float(self.hits) / lookups if lookups else 0.0,
+        }
+
+    # | Linked list maintenance (call with the lock held).
+    def _link(self, entry):
+        first = self.root[self.NEXT]
+        entry[self.PREV], entry[self.NEXT] = self.root, first
+        first[self.PREV] = self.root[self.NEXT] = entry
+
+    def _unlink(self, entry):
+        prev, next = entry[self.PREV], entry[self.NEXT]
+        prev[self.NEXT], next[self.PREV] = next, prev
+
+def copy_node(widget, children=None):
+    """Copy a thawed widget node (whose children are still state ids),
+    sharing no mutable state with the original. We sidestep the
+    pickling protocol (``Widget.__getstate__'' would try to freeze our
+    children), and copy the instance dictionary directly. Nodes whose
+    children have already been thawed can be copied by giving their
+    `children' state ids."""
+    state = dict(widget.__dict__)
+    state['parent'] = None
+    if children is not None:
+        state['children'] = children
+
+    node = widget.__class__.__new__(widget.__class__)
+    node.__dict__.update(deepcopy(state))
+    return node
+
+# The process-wide cache of thawed states.
+STATES = LRUCache(getattr(settings, 'WIDGETS_STATE_CACHE_BYTES', 16 << 20))
+
+def get_node(state_id):
+    """Return a private copy of the cached node for `state_id', or
+    None if it isn't cached."""
+    node = STATES.get(state_id)
+    if node is not None:
+        node = copy_node(node)
+    return node
+
+def put_node(state_id, widget, size):
+    """Cache (a copy of) the freshly thawed node `widget', of about
+    `size' bytes frozen."""
+    STATES.put(state_id, copy_node(widget), size)
+
+def invalidate_node(state_id):
+    """Forget about `state_id' in both tiers (eg. once the state has
+    been deleted)."""
+    STATES.invalidate(state_id)
+    if SHARED is not None:
+        SHARED.delete(key_of_state_id(state_id))
+
+# | The shared tier.
+class Backend(object):
+    """The interface of shared state cache backends. Keys are strings,
+    values are frozen states."""
+    def get_many(self, keys):
+        """Return a dict of the values found for `keys'."""
+        raise NotImplementedError
+
+    def set_many(self, mapping, timeout):
+        raise NotImplementedError
+
+    def add(self, key, value, timeout):
+        """Set `key' unless it is set already, returning whether it
+        was."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+class LocalMemoryBackend(Backend):
+    """A stand-in for tests & development. Entries never expire."""
+    def __init__(self, location=None):
+        self.data = {}
+
+    def get_many(self, keys):
+        return dict((key, self.data[key]) for key in keys if key in self.data)
+
+    def set_many(self, mapping, timeout):
+        self.data.update(mapping)
+
+    def add(self, key, value, timeout):
+        if key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+class MemcachedBackend(Backend):
+    """Talks to memcached through python-memcached. `location' is a
+    semicolon separated list of servers."""
+    def __init__(self, location):
+        import memcache
+        self.client = memcache.Client(location.split(';'))
+
+    def get_many(self, keys):
+        return self.client.get_multi(keys)
+
+    def set_many(self, mapping, timeout):
+        self.client.set_multi(mapping, time=timeout)
+
+    def add(self, key, value, timeout):
+        return bool(self.client.add(key, value, time=timeout))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+BACKENDS = {
+    'locmem'    : LocalMemoryBackend,
+    'memcached' : MemcachedBackend,
+}
+
+def backend_of_uri(uri):
+    """Instantiate the backend for a cache URI, in the style of
+    Django's CACHE_BACKEND: 'scheme://location/'."""
+    scheme, rest = uri.split(':', 1)
+    if scheme not in BACKENDS:
+        raise ValueError, 'Unknown shared state cache backend %r' % scheme
+    return BACKENDS[scheme](rest.lstrip('/').rstrip('/'))
+
+# The configured backend, if any.
+SHARED = None
+if getattr(settings, 'WIDGETS_SHARED_STATE_CACHE', None):
+    SHARED = backend_of_uri(settings.WIDGETS_SHARED_STATE_CACHE)
+
+# Memcached won't take relative expiry times past 30 days.
+SHARED_TIMEOUT = getattr(settings, 'WIDGETS_SHARED_STATE_CACHE_TIMEOUT',
+                         60*60*24*30)
+
+def key_of_state_id(state_id):
+    return 'widgets_state:%d' % state_id
+
+def get_frozen_many(state_ids):
+    """Look up frozen states in the shared tier, returning a dict of
+    state id -> frozen state for those found."""
+    if SHARED is None or not state_ids:
+        return {}
+
+    keys  = dict((key_of_state_id(state_id), state_id)
+                 for state_id in state_ids)
+    found = SHARED.get_many(keys.keys())
+    return dict((keys[key], frozen) for key, frozen in found.iteritems())
+
+def put_frozen_many(frozen):
+    """Share the frozen states in the dict `frozen' (state id -> frozen
+    state)."""
+    if SHARED is None or not frozen:
+        return
+
+    SHARED.set_many(
+        dict((key_of_state_id(state_id), value)
+             for state_id, value in frozen.iteritems()),
+        SHARED_TIMEOUT)
@@ -1,46 +1,69 @@
 {% comment %}
-This renders javascript for interacting with widget ajax handlers via
-post requests (using jquery)
+This renders the javascript dispatcher for widget ajax handlers, for
+the calls rendered by the ``widget_call'' tag:
+
+  widget_call(ajaxurl, args, callback)
+
+posts `args' to the handler (using jquery), and passes the decoded
+response to `callback'. Calls needing the user to log in (or to fill
+in a captcha) are retried once they have. It is included once per page.
+
+  widget_call_batch(ajaxurl, calls, callback)
+
+makes many calls at once, through the ``batch'' handler of the page at
+`ajaxurl': `calls' is a list of [widget namespace, handler name, args],
+and `callback' gets the list of their responses. The namespace may be
+the protected one of data-namespace, trailing "_" included (eg.
+"_root_3_"). Malformed calls make the whole batch fail with a 404.
 {% endcomment %}
 
-function {{ name }} () {
-  $.ajax({
-    type: "POST",
-    url: "{{ ajaxurl }}",
-    data: {{ args }},
-    success: function ({{ variable }}) {
-      {{ callback }}
-    },
-    error: function (request) {
-        console.log(request.status)
-      if (request.status == 403) {
-        $.mixerbox("{% url login_dialog %}", "captcha_login", function(paa) {
-          {% comment %}
-             // The rest of the page won't show the user as logged in until a
-             // reload, and the paa (post_auth_action) in the case of a new
-             // account creation won't get displayed.
-             // This is a lenghty ajax operation, so there is no great way of
-             // doing that, other than reloading the page first and then doing
-             // the ajax action, or using ajax to refresh all possible dom
-             // nodes that are dependant on login status.
-             // Maybe when all the widgets on a page leave edit mode,
-             // then the page can reload and display the paa dialog?
-          {% endcomment %}
-          {{ name }}()
-        })
-      } else if (request.status == 409) {
-        $.mixerbox("{% url captcha_dialog %}", "captcha_login", function(paa) {
-          {% comment %}
-             // paa may contain a url to open in a dialog that resends the
-             // email valdiation code, not important if it interrupts flow
-          {% endcomment %}
-          {{ name }}()
-        })
-      }
-    },
-    dataType: "json"
-  })
-}
+function widget_call(ajaxurl, args, callback) {
+  function call() {
+    $.ajax({
+      type: "POST",
+      url: ajaxurl,
+      data: args,
+      success: callback,
+      error: function (request) {
+        if (request.status == 403) {
+          $.mixerbox("{% url login_dialog %}", "captcha_login", function(paa) {
+            {% comment %}
+               // The rest of the page won't show the user as logged in until a
+               // reload, and the paa (post_auth_action) in the case of a new
+               // account creation won't get displayed.
+               // This is a lenghty ajax operation, so there is no great way of
+               // doing that, other than reloading the page first and then doing
+               // the ajax action, or using ajax to refresh all possible dom
+               // nodes that are dependant on login status.
+               // Maybe when all the widgets on a page leave edit mode,
+               // then the page can reload and display the paa dialog?
+            {% endcomment %}
+            call()
+          })
+        } else if (request.status == 409) {
+          $.mixerbox("{% url captcha_dialog %}", "captcha_login", function(paa) {
+            {% comment %}
+               // paa may contain a url to open in a dialog that resends the
+               // email valdiation code, not important if it interrupts flow
+            {% endcomment %}
+            call()
+          })
+        }
+      },
+      dataType: "json"
+    })
+  }
 
-{{ name }}()
+  call()
+}
 
+function widget_call_batch(ajaxurl, calls, callback) {
+  var args = {}
+  $.each(calls, function (i, call) {
+    args[i] = call[0] + " " + call[1]
+    $.each(call[2] || {}, function (name, value) {
+      args[i + "." + name] = value
+    })
+  })
+  widget_call(ajaxurl, args, callback)
+}
@@ -0,0 +1,145 @@
+{% comment %}
+This renders the javascript controller shared by the widgets of a page
+(see _widget.html). Each widget container carries its namespace, ajax
+urls & css classes in data attributes:
+
+  data-namespace   - the protected namespace of the widget (with the
+                     trailing "_"), prefixing the ids of its elements
+  data-edit-url    - the ajax url of the widget's "edit" handler
+  data-delete-url  - the ajax url of the page's "delete-widget" handler
+  data-css-hover   - the css class of the widget while hovered
+  data-adding      - present when the widget was just added
+
+``widget_controller.attach_all()'' attaches the widgets not attached
+yet, exporting their protected API.
+{% endcomment %}
+
+var widget_controller = {
+  // The widgets attached, by namespace.
+  widgets: {},
+
+  attach_all: function () {
+    $("div.widget[data-namespace]").each(function () {
+      if (!widget_controller.widgets[$(this).attr("data-namespace")])
+        widget_controller.attach(this)
+    })
+  },
+
+  attach: function (container) {
+    var c = widget_controller
+    var w = {
+      ns          : $(container).attr("data-namespace"),
+      edit_url    : $(container).attr("data-edit-url"),
+      delete_url  : $(container).attr("data-delete-url"),
+      css_hover   : $(container).attr("data-css-hover"),
+      editing     : false,
+      adding      : false,
+      saved       : null
+    }
+    c.widgets[w.ns] = w
+
+    // The protected API of the widget.
+    window[w.ns + "edit"]   = function (adding) { c.edit(w, adding) }
+    window[w.ns + "save"]   = function () { c.save(w) }
+    window[w.ns + "cancel"] = function () { c.cancel(w) }
+    window[w.ns + "html"]   = function (content) { return c.html(w, content) }
+    window[w.ns + "delete"] = function () { c.remove(w) }
+
+    $("a#" + w.ns + "href").click(function () {
+      if (!w.editing) {
+        widget_call(w.edit_url, null, function (data) {
+          c.edit(w)
+          c.html(w, data)
+        })
+      }
+    })
+
+    if ($(container).attr("data-adding"))
+      c.edit(w, true)
+    else
+      c.noedit(w)
+  },
+
+  edit: function (w, adding) {
+    w.editing = true
+    if (!adding)
+      w.saved = widget_controller.html(w)
+    else
+      w.adding = true
+
+    $("a#" + w.ns + "href").hide()
+    $("div#" + w.ns + "bar").show()
+    $("div#" + w.ns + "headerbar").fadeIn(100)
+
+    $("div#" + w.ns + "handle").parent().addClass(w.css_hover)
+
+    widget_controller.disable_buttons(w)
+  },
+
+  cancel: function (w) {
+    if (typeof window[w.ns + "cancel_cb"] !== "undefined")
+      window[w.ns + "cancel_cb"]()
+
+    if (w.adding) {
+      widget_controller.remove(w)
+    } else {
+      widget_controller.noedit(w)
+      widget_controller.html(w, w.saved)
+    }
+  },
+
+  save: function (w) {
+    $("div#" + w.ns + "bar").hide()
+
+    window[w.ns + "save_cb"](function () {
+      widget_controller.noedit(w)
+      onecolumn_update_edit_info()
+    })
+  },
+
+  html: function (w, content) {
+    return $("div#" + w.ns + "contents").html(content)
+  },
+
+  noedit: function (w) {
+    w.editing = false
+    w.adding = false
+    $("div#" + w.ns + "handle").parent().removeClass(w.css_hover)
+    $("a#" + w.ns + "href").show()
+    $("div#" + w.ns + "bar").hide()
+
+    $("div#" + w.ns + "headerbar").hide()
+
+    widget_controller.enable_buttons(w)
+  },
+
+  remove: function (w) {
+    widget_call(w.delete_url, { which: w.ns }, function (data) {
+      $("#" + w.ns + "container").remove()
+      delete widget_controller.widgets[w.ns]
+    })
+  },
+
+  enable_buttons: function (w) {
+    var events = "." + w.ns + "buttons"
+    $("div#" + w.ns + "handle,a#" + w.ns + "move_button")
+      .bind("mouseenter" + events, function () {
+        $("#" + w.ns + "outer").addClass(w.css_hover)
+    }).bind("mouseleave" + events, function () {
+        $("#" + w.ns + "outer").removeClass(w.css_hover)
+    })
+
+    $("div#" + w.ns + "outer")
+      .bind("mouseenter" + events, function () {
+        $(".container-button").hide()
+        $("#" + w.ns + "move_button").fadeIn(100)
+    }).bind("mouseleave" + events, function () {
+        $("#" + w.ns + "move_button").fadeOut(100)
+    })
+  },
+
+  disable_buttons: function (w) {
+    $("#" + w.ns + "move_button").hide()
+    $("*").unbind("." + w.ns + "buttons")
+  }
+}
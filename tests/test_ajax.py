@@ -5,6 +5,7 @@ if __name__ == '__main__':
     conf.configure_django('www.settings')
 
 import unittest
+import cjson
 import django.test
 from django.conf import settings
 
@@ -42,6 +43,27 @@ class TestAjax(django.test.TestCase):
         self.assertEquals(200, response.status_code)
         self.assertEquals('"HELLOTHERE"', response.content)
 
+        # Many calls at once, through the page.
+        response = self.client.post('%s/_ajax/batch' % uri, {
+            '0': '_root_0 concatupper', '0.arg0': 'a', '0.arg1': 'b',
+            '1': '_root_0 concatupper', '1.arg0': 'c', '1.arg1': 'd',
+        })
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(['AB', 'CD'], cjson.decode(response.content))
+
+        # Namespaces may be the protected ones (see ``_call.js'').
+        response = self.client.post('%s/_ajax/batch' % uri, {
+            '0': '_root_0_ concatupper', '0.arg0': 'e', '0.arg1': 'f',
+        })
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(['EF'], cjson.decode(response.content))
+
+        # Malformed calls are rejected.
+        for fields in ({'x': '_root_0 concatupper'}, {'0': '_root_0'},
+                       {'0.arg0': 'a'}, {'0': '_elsewhere_0 concatupper'}):
+            response = self.client.post('%s/_ajax/batch' % uri, fields)
+            self.assertEquals(404, response.status_code)
+
 def test_suite():
     from util.django_layer import make_django_suite
     return make_django_suite(__name__)
@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import shutil
+import tempfile
+import unittest
+
+from www.widgets         import archive
+from www.widgets.widget  import Widget, freeze_session
+from www.widgets.models  import WidgetState, WikiHome, WikiPage
+from www.widgets.archive import (Segments, archivable_states,
+                                 archive_states, is_stub)
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.path     = tempfile.mkdtemp()
+        self.segments = archive.SEGMENTS
+        archive.SEGMENTS = Segments(self.path)
+
+    def tearDown(self):
+        archive.SEGMENTS = self.segments
+        shutil.rmtree(self.path)
+
+    def test_segments(self):
+        segments = archive.SEGMENTS
+        first  = segments.append(['one', 'three'])
+        second = segments.append(['four'])
+        self.assertEquals([(0, 0, 3), (0, 3, 5)], first)
+        self.assertEquals([(0, 8, 4)], second)
+        # Reads see what was appended after mapping the segment.
+        self.assertEquals('three', segments.read(*first[1]))
+        self.assertEquals('four', segments.read(*second[0]))
+
+    def test_archive_states(self):
+        root = Widget()
+        root.append(Widget())
+        root[0].which = 'archived'
+        root.freeze()
+
+        state_ids = [root._state_id, root[0]._state_id]
+        self.assertEquals(2, archive_states(state_ids))
+        self.assertEquals(0, archive_states(state_ids))
+        for value in WidgetState.objects.filter(pk__in=state_ids)\
+                                        .values_list('widget', flat=True):
+            self.assert_(is_stub(value))
+
+        # Archived states thaw as any other.
+        state = WidgetState.objects.get(pk=root._state_id)
+        self.assertEquals('archived', state.widget[0].which)
+
+    def test_shared_states(self):
+        wiki, _ = WikiHome.objects.get_or_create(slug='archive-town-usa')
+        pages = []
+        for slug in ('Archived', 'Sharing'):
+            root = Widget()
+            root.append(Widget())
+            root[0].which = 'shared'
+            if slug == 'Archived':
+                root.append(Widget())
+                root[1].which = 'mine'
+            root.freeze()
+            pages.append((root, WikiPage.objects.create(
+                wiki=wiki, slug=slug, head=root.get_state_object())))
+        (archived, archived_page), (sharing, _) = pages
+        shared = sharing[0]._state_id
+        self.assertEquals(shared, archived[0]._state_id)
+
+        # A new version of the first page leaves its states in its
+        # history only, but the shared one is still part of the head
+        # of the other.
+        old, mine = archived._state_id, archived[1]._state_id
+        self.assert_(WidgetState.objects.get(pk=mine).digest)
+        with freeze_session():
+            archived[0].which = 'new'
+            archived[0].freeze()
+            archived[1].which = 'mine again'
+            archived[1].freeze()
+        archived_page.head = archived.get_state_object()
+        archived_page.save()
+
+        state_ids = archivable_states(archived_page, keep_versions=1)
+        self.assertEquals(set([old, mine]), state_ids)
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
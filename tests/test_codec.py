@@ -0,0 +1,50 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import cPickle
+import unittest
+
+from www.widgets import codec
+
+class TestCodec(unittest.TestCase):
+    def test_roundtrip(self):
+        for obj in ({'contents': 'x' * 1000}, {'contents': 'x'}):
+            encoded = codec.encode(obj)
+            self.assert_(codec.is_encoded(encoded))
+            self.assertEquals(obj, codec.decode(encoded))
+
+    def test_compression(self):
+        big, small = codec.encode('x' * 1000), codec.encode('x')
+        self.assertEquals(codec.ZLIB, big[0])
+        self.assertEquals(codec.PLAIN, small[0])
+        self.assert_(len(big) < 1000)
+
+    def test_legacy(self):
+        # Legacy values are plain pickles, without a header byte.
+        self.failIf(codec.is_encoded(cPickle.dumps({'a': 1})))
+        self.failIf(codec.is_encoded(cPickle.dumps({'a': 1}, 2)))
+        self.failIf(codec.is_encoded(None))
+
+    def test_encoded(self):
+        # Values encoded already are neither decoded nor encoded again.
+        codec.STATS.reset()
+        field   = codec.WidgetStateField()
+        encoded = codec.Encoded(codec.encode({'a': 1}))
+        self.assert_(field.to_python(encoded) is encoded)
+        self.assertEquals(encoded, field.get_db_prep_value(encoded))
+        self.assertEquals({}, codec.STATS.summary())
+
+    def test_stats(self):
+        codec.STATS.reset()
+        codec.decode(codec.encode('x' * 1000))
+        self.assertEquals(1, codec.STATS.summary()[codec.ZLIB]['count'])
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import unittest
+
+from django.utils.safestring import SafeData
+
+from www.widgets            import fragments
+from www.widgets.widget     import Widget
+from www.widgets.statecache import LocalMemoryBackend
+
+class TestFragments(unittest.TestCase):
+    def setUp(self):
+        self.backend = fragments.FRAGMENTS
+        fragments.FRAGMENTS = LocalMemoryBackend()
+
+    def tearDown(self):
+        fragments.FRAGMENTS = self.backend
+
+    def test_keys(self):
+        page = Widget()
+        page.append(Widget())
+        widget = page[0]
+        template = 'widgets/_widget.html'
+
+        # Widgets that were never frozen aren't cached.
+        self.assertEquals(None, fragments.key_of_widget(widget, template, '/'))
+
+        page.freeze()
+        key = fragments.key_of_widget(widget, template, '/')
+        self.assertEquals(key, fragments.key_of_widget(widget, template, '/'))
+        self.assertNotEquals(
+            key, fragments.key_of_widget(widget, template, '/other'))
+
+        # Changes make for new keys.
+        widget.which = 'changed'
+        widget.freeze()
+        self.assertNotEquals(
+            key, fragments.key_of_widget(widget, template, '/'))
+
+    def test_cache(self):
+        fragments.put_many({'a': '<p>a</p>'})
+        found = fragments.get_many(['a', 'b'])
+        self.assertEquals({'a': '<p>a</p>'}, found)
+        self.assert_(isinstance(found['a'], SafeData))
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
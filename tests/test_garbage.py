@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import os
+import tempfile
+import unittest
+
+from www.widgets.widget  import Widget
+from www.widgets.models  import WidgetState, WikiHome, WikiPage
+from www.widgets.garbage import Marks, mark, sweep
+
+class TestGarbage(unittest.TestCase):
+    def test_marks(self):
+        marks = Marks(20)
+        marks.mark(3)
+        marks.mark(17)
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            marks.save(path)
+            marks = Marks.load(path)
+        finally:
+            os.remove(path)
+
+        self.assertEquals(20, marks.max_pk)
+        self.assertEquals([3, 17], [pk for pk in range(21) if pk in marks])
+        # Newer states are always reachable.
+        self.assert_(21 in marks)
+
+    def test_collect(self):
+        page = Widget()
+        page.append(Widget())
+        page[0].which = 'old'
+        page.freeze()
+        old_child = page[0]._state_id
+
+        page[0].which = 'new'
+        page[0].freeze()
+
+        wiki, _ = WikiHome.objects.get_or_create(slug='garbage-town-usa')
+        WikiPage.objects.create(wiki=wiki, slug='Garbage',
+                                head=page.get_state_object())
+
+        orphan = Widget()
+        orphan.freeze()
+
+        # Everything in the history of the page is reachable.
+        marks = mark(batch_size=2)
+        self.assert_(old_child in marks)
+        self.assert_(page[0]._state_id in marks)
+        self.assert_(orphan._state_id not in marks)
+
+        last, deleted, retired, size = \
+            sweep(marks, batch_size=1, start_pk=orphan._state_id + 1).next()
+        self.assertEquals((orphan._state_id, 1, 0), (last, deleted, retired))
+        self.assertEquals(0, WidgetState.objects.filter(
+            pk=orphan._state_id).count())
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import unittest
+
+from www.widgets import page
+
+class Cache(object):
+    def __init__(self):
+        self.values   = {}
+        self.timeouts = {}
+        self.lookups  = 0
+
+    def get_many(self, keys):
+        self.lookups += 1
+        return dict((key, self.values[key])
+                    for key in keys if key in self.values)
+
+    def set(self, key, value, timeout):
+        self.values[key]   = value
+        self.timeouts[key] = timeout
+
+class Listing(object):
+    def __init__(self, name, latitude, longitude):
+        self.name         = name
+        self.address_line = '1 Main St'
+        self.latitude     = latitude
+        self.longitude    = longitude
+
+class Table(object):
+    LISTINGS = {'placed': Listing('Placed', 37.7, -122.4),
+                'nowhere': Listing('Nowhere', None, None)}
+    guids = []
+
+    @classmethod
+    def get_by_guid(cls, guid):
+        cls.guids.append(guid)
+        return cls.LISTINGS.get(guid)
+
+class TestListings(unittest.TestCase):
+    def setUp(self):
+        self.saved = page.cache, page.ListingTable, \
+                     page.LISTING_NEGATIVE_TIMEOUT
+        page.cache, page.ListingTable = Cache(), Table
+        Table.guids = []
+
+    def tearDown(self):
+        page.cache, page.ListingTable, page.LISTING_NEGATIVE_TIMEOUT = \
+            self.saved
+
+    def test_located_listings(self):
+        guids  = ['placed', 'nowhere', u'caf\xe9', 'placed']
+        placed = {'placed': ('Placed', '1 Main St', 37.7, -122.4)}
+
+        # Cold, the cache is looked at once & every guid looked up.
+        self.assertEquals(placed, page.located_listings(guids))
+        self.assertEquals(1, page.cache.lookups)
+        self.assertEquals([u'caf\xe9', 'nowhere', 'placed'],
+                          sorted(Table.guids))
+        self.assertEquals(
+            [page.LISTING_NEGATIVE_TIMEOUT, page.LISTING_TIMEOUT],
+            [page.cache.timeouts[page.key_of_listing_guid(guid)]
+             for guid in ('nowhere', 'placed')])
+
+        # Warm, nothing is looked up.
+        Table.guids = []
+        self.assertEquals(placed, page.located_listings(guids))
+        self.assertEquals(2, page.cache.lookups)
+        self.assertEquals([], Table.guids)
+
+        # What isn't a listing may not be cached.
+        page.cache, page.LISTING_NEGATIVE_TIMEOUT = Cache(), 0
+        self.assertEquals(placed, page.located_listings(guids))
+        self.assertEquals([page.key_of_listing_guid('placed')],
+                          page.cache.values.keys())
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
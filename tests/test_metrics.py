@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import with_statement
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import unittest
+
+from www.widgets         import metrics
+from www.widgets.page    import Page
+from www.widgets.router  import ajax
+from www.widgets.widget  import Widget
+from www.widgets.metrics import Histogram, measure
+
+class Counter(Widget):
+    count = 0
+
+    @ajax('count')
+    def count_up(self):
+        self.count += 1
+        self.freeze()
+        return self.count
+
+class Delegate(object):
+    def freeze(self, page):
+        pass
+
+class Request(object):
+    method = 'POST'
+    POST   = {}
+    META   = {}
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.rate = metrics.RATE
+        metrics.REGISTRY.reset()
+
+    def tearDown(self):
+        metrics.RATE = self.rate
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in [0, 1, 3, 5, 100]:
+            histogram.add(value)
+        summary = histogram.summary()
+        self.assertEquals((5, 100), (summary['count'], summary['max']))
+        self.assertEquals(4, summary['p50'])
+        self.assertEquals(100, summary['p99'])
+
+    def test_measure(self):
+        metrics.RATE = 0
+        with measure('Widget.nothing'):
+            pass
+        self.assertEquals({}, metrics.REGISTRY.summary())
+
+        metrics.RATE = 1
+        with measure('Widget.freeze'):
+            w = Widget()
+            w.freeze()
+            # Nested handlers are measured along.
+            with measure('Widget.again'):
+                w.freeze()
+        summary = metrics.REGISTRY.summary()
+        self.assertEquals(2, summary['Widget.freeze']['freezes']['max'])
+        self.assertEquals(1, summary['Widget.again']['freezes']['max'])
+        self.assert_('Widget.freeze' in metrics.REGISTRY.dump())
+
+    def test_page(self):
+        page = Page(Delegate())
+        page.append(Counter())
+        page.freeze()
+
+        # Changes are frozen as the request through the page completes,
+        # on behalf of its handler.
+        metrics.RATE = 1
+        response = page.route(Request(), '_0/_ajax/count')
+        self.assertEquals('1', response.content)
+        summary = metrics.REGISTRY.summary()['Counter.ajax_count']
+        self.assertEquals(1, summary['freezes']['count'])
+        self.assertEquals(2, summary['freezes']['max'])
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import unittest
+
+from django.contrib.auth.models import AnonymousUser
+from django.http                import HttpRequest, HttpResponse
+
+from www.widgets            import pagecache
+from www.widgets.statecache import LocalMemoryBackend
+
+class LateBackend(LocalMemoryBackend):
+    """Only has what it holds from the second lookup on."""
+    lookups = 0
+
+    def get_many(self, keys):
+        self.lookups += 1
+        if self.lookups == 1:
+            return {}
+        return super(LateBackend, self).get_many(keys)
+
+class FakeWikiPage(object):
+    def __init__(self, head_id):
+        self.head_id = head_id
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.backend = pagecache.PAGES
+        pagecache.PAGES = LocalMemoryBackend()
+        pagecache.STATS.reset()
+        self.rendered = 0
+
+    def tearDown(self):
+        pagecache.PAGES = self.backend
+
+    def request(self):
+        request = HttpRequest()
+        request.method = 'GET'
+        request.path   = '/san-francisco-ca/Page'
+        request.user   = AnonymousUser()
+        return request
+
+    def respond(self):
+        self.rendered += 1
+        return HttpResponse('page %d' % self.rendered)
+
+    def test_cache(self):
+        wikipage = FakeWikiPage(1)
+        for i in range(3):
+            response = pagecache.cached_response(
+                self.request(), wikipage, '', self.respond)
+            self.assertEquals('page 1', response.content)
+        self.assertEquals(1, self.rendered)
+
+        # Anything but the page itself goes through.
+        pagecache.cached_response(self.request(), wikipage, '-1',
+                                  self.respond)
+        self.assertEquals(2, self.rendered)
+
+        # A new head is a new page.
+        pagecache.invalidate(1)
+        response = pagecache.cached_response(
+            self.request(), wikipage, '', self.respond)
+        self.assertEquals('page 3', response.content)
+
+        summary = pagecache.STATS.summary()
+        self.assertEquals((2, 2, 1), (summary['hit'], summary['miss'],
+                                      summary['bypass']))
+        self.assertEquals(0.5, summary['hit_rate'])
+
+    def test_wait(self):
+        # Another request is rendering the page, and caches it as we
+        # wait.
+        pagecache.PAGES = LateBackend()
+        wikipage = FakeWikiPage(1)
+        request  = self.request()
+        key      = pagecache.key_of_head_id(1)
+        variant  = pagecache.variant_of_request(request)
+        pagecache.PAGES.add('%s:%s:lock' % (key, variant), 1, 10)
+        pagecache.PAGES.set_many(
+            {key: {variant: (200, 'text/html', 'theirs')}}, 10)
+
+        response = pagecache.cached_response(request, wikipage, '',
+                                             self.respond)
+        self.assertEquals('theirs', response.content)
+        self.assertEquals(0, self.rendered)
+        self.assertEquals(1, pagecache.STATS.summary()['wait'])
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import unittest
+
+from django.http     import HttpRequest, HttpResponse
+from django.template import Template, Context
+
+from www.widgets.router import (NAMESPACES, REVERSED, ROUTES, Resolver,
+                                Routable, SplicePlan, etag_of,
+                                namespace_nodes, subns, view)
+from www.widgets.widget import Widget
+from www.widgets.tests.widgets import TestWidget
+
+class TestNamespacedTemplates(unittest.TestCase):
+    def test_namespace_nodes(self):
+        source = ('<div id="__box">{% if x %}<a class="___link">{{ x }}</a>'
+                  '{% else %}__none{% endif %}</div>')
+        template = Template(source)
+        namespace_nodes(template.nodelist)
+
+        # Compiled once, rendered with any namespace.
+        for x in ('a__b', ''):
+            for protected_ns in ('_root_0', '_root_1_2'):
+                expected = Template(subns(protected_ns, '_digest', source))
+                context  = Context({NAMESPACES: (protected_ns, '_digest'),
+                                    'x': x})
+                self.assertEquals(expected.render(Context({'x': x})),
+                                  template.render(context))
+
+class TestSplicePlan(unittest.TestCase):
+    def test_same_as_subns(self):
+        texts = ['', '_', '__', '___', '____', '_____', '______',
+                 'a___b__c', '_a_', '__a___', 'a____b', 'x_____y_']
+        for text in texts:
+            plan = SplicePlan(text)
+            for protected_ns, private_ns in [('_root_0', '_abc'),
+                                             ('_root', '__'),
+                                             ('_root_1_', '_a_b_')]:
+                self.assertEquals(subns(protected_ns, private_ns, text),
+                                  plan.splice(protected_ns, private_ns))
+
+class Counter(Routable):
+    def __init__(self):
+        self.count = 0
+
+    def etag(self, request, path):
+        return etag_of(path)
+
+    @view('^$', 'root')
+    def root(self, request):
+        self.count += 1
+        return HttpResponse('count %d' % self.count)
+
+class TestRoutes(unittest.TestCase):
+    def test_shared(self):
+        # Routes are built once per class.
+        self.assert_(Counter().routes() is Counter.routes())
+
+        counter = Counter()
+        view, args, kwargs = counter.resolve('')
+        self.assert_(view.im_self is counter)
+        self.assertEquals('', counter.reverse(counter.root))
+        self.assertEquals('', counter.reverse('root'))
+
+    def test_render_path(self):
+        # Reversing the views of a page of widgets, as rendering it
+        # does, builds a resolver per class rather than per call.
+        page = Widget()
+        for i in range(40):
+            page.append(TestWidget())
+
+        built = []
+        init  = Resolver.__init__
+        def counting_init(resolver, *pairs):
+            built.append(resolver)
+            init(resolver, *pairs)
+
+        ROUTES.clear()
+        REVERSED.clear()
+        Resolver.__init__ = counting_init
+        try:
+            for i in range(10):
+                for key in page:
+                    page[key].reverse_ajax('concatupper')
+                    page[key].reverse(page[key].testview)
+        finally:
+            Resolver.__init__ = init
+
+        # (Widget, for the children's URLs, & TestWidget.)
+        self.assertEquals(2, len(built))
+
+class TestConditional(unittest.TestCase):
+    def test_not_modified(self):
+        counter = Counter()
+        request = HttpRequest()
+        request.method = 'GET'
+        response = counter(request, '')
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(etag_of(''), response['ETag'])
+
+        # The view isn't even called.
+        request.META['HTTP_IF_NONE_MATCH'] = '"other", %s' % etag_of('')
+        response = counter(request, '')
+        self.assertEquals(304, response.status_code)
+        self.assertEquals(1, counter.count)
+
+        request.method = 'POST'
+        self.assertEquals(200, counter(request, '').status_code)
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
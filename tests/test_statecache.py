@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import unittest
+
+from www.widgets.widget     import Widget
+from www.widgets.statecache import (LRUCache, LocalMemoryBackend,
+                                    backend_of_uri, copy_node)
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(10)
+        cache.put(1, 'one', 4)
+        cache.put(2, 'two', 4)
+        self.assertEquals('one', cache.get(1))
+
+        # 2 is now the least recently used, so it goes first.
+        cache.put(3, 'three', 4)
+        self.assert_(2 not in cache)
+        self.assertEquals('one', cache.get(1))
+        self.assertEquals('three', cache.get(3))
+        self.assertEquals(8, cache.stats['bytes'])
+
+        # Too big to cache at all.
+        cache.put(4, 'four', 11)
+        self.assert_(4 not in cache)
+        self.assertEquals(2, len(cache))
+
+    def test_counters(self):
+        cache = LRUCache(10)
+        cache.put(1, 'one', 1)
+        cache.get(1)
+        cache.get(2)
+        cache.invalidate(1)
+        cache.get(1)
+
+        stats = cache.stats
+        self.assertEquals(1, stats['hits'])
+        self.assertEquals(2, stats['misses'])
+        self.assertEquals(0, stats['bytes'])
+
+    def test_copy_node(self):
+        w = Widget()
+        w.items = ['a', 'b']
+        w.children = {0: 123}
+
+        c = copy_node(w)
+        c.items.append('c')
+        self.assertEquals(['a', 'b'], w.items)
+        self.assertEquals({0: 123}, c.children)
+        self.assert_(c.children is not w.children)
+
+class TestSharedBackends(unittest.TestCase):
+    def test_backend_of_uri(self):
+        self.assert_(isinstance(backend_of_uri('locmem://'),
+                                LocalMemoryBackend))
+        self.assertRaises(ValueError, backend_of_uri, 'carrier-pigeon://')
+
+    def test_local_memory(self):
+        backend = LocalMemoryBackend()
+        backend.set_many({'a': 'frozen-a', 'b': 'frozen-b'}, 60)
+        self.assertEquals({'a': 'frozen-a'}, backend.get_many(['a', 'c']))
+        backend.delete('a')
+        self.assertEquals({}, backend.get_many(['a']))
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
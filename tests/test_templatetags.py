@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+
+if __name__ == '__main__':
+    import conf
+    conf.configure_django('www.settings')
+
+import unittest
+
+from django.template import Template, Context
+
+from www.widgets.tests.widgets import TestWidget
+
+class TestWidgetCall(unittest.TestCase):
+    def test_stub(self):
+        template = Template(
+            '{% load widgets %}'
+            '{% widget_call widget "concatupper" %}'
+            '  { arg0: "a", arg1: "b" }'
+            '{% widget_callback result %}'
+            'alert(result)'
+            '{% endwidget_call %}')
+        context = Context({'widget': TestWidget()})
+
+        # Calls render to the same (compact) stub every time.
+        rendered = template.render(context)
+        self.assertEquals(
+            'widget_call("_ajax/concatupper", { arg0: "a", arg1: "b" },\n'
+            '  function (result) {alert(result)})', rendered)
+        self.assertEquals(rendered, template.render(context))
+
+def test_suite():
+    from util.django_layer import make_django_suite
+    return make_django_suite(__name__)
+
+if __name__ == '__main__':
+    unittest.main()
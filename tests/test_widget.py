@@ -1,16 +1,19 @@
 from __future__ import absolute_import
+from __future__ import with_statement
 
 if __name__ == '__main__':
     import conf
     conf.configure_django('www.settings')
 
+import hashlib
 import unittest
 
 from django.http import Http404
 
-from www.widgets.widget import Widget
+from www.widgets.widget import Widget, freeze_session
 from www.widgets.models import WidgetState
 from www.widgets.router import view
+from www.widgets.loader import TreeLoader, thaw
 
 # Has to be toplevel so it can be pickled.
 class MyWidget(Widget):
@@ -18,6 +21,11 @@ class MyWidget(Widget):
     def test_view(self, request, an_int):
         return self.parent_key, an_int
 
+class EchoWidget(Widget):
+    @view('^echo/(?P<word>\w+)$')
+    def echo(self, request, word):
+        return self, request, word
+
 class TestWidget(unittest.TestCase):
     def test_basic(self):
         w = Widget()
@@ -68,6 +76,7 @@ class TestWidget(unittest.TestCase):
 
         # Now make sure updates work up the tree.
         state_ids = w0.map(lambda w: w._state_id)
+        w1b.which = '1-b, changed'
         w1b.freeze()
         new_state_ids = w0.map(lambda w: w._state_id)
 
@@ -76,6 +85,159 @@ class TestWidget(unittest.TestCase):
         self.assertEquals(set([state.widget[0][0]._state_id]),
                           set(new_state_ids) & set(state_ids))
 
+    def test_bulk_thaw(self):
+        # A tree thaws with one fetch per level, not one per widget.
+        root = Widget()
+        for i in range(3):
+            child = Widget()
+            child.which = i
+            root.append(child)
+            for j in range(4):
+                grandchild = Widget()
+                grandchild.which = (i, j)
+                child.append(grandchild)
+        root.freeze()
+
+        fetches = []
+        class CountingLoader(TreeLoader):
+            def fetch(self, state_ids):
+                fetches.append(len(state_ids))
+                return super(CountingLoader, self).fetch(state_ids)
+
+        thawed = CountingLoader().load([root._state_id])[root._state_id]
+        self.assertEquals([1, 3, 12], fetches)
+
+        self.assertEquals(1, thawed[1].which)
+        self.assertEquals((2, 3), thawed[2][3].which)
+        self.assertEquals(thawed, thawed[1].parent)
+        self.assertEquals(thawed[2], thawed[2][3].parent)
+        self.assertEquals(3, thawed[2][3].parent_key)
+
+        # State ids aren't frozen, but restored when thawing.
+        self.assertEquals(root._state_id, thawed._state_id)
+        self.assertEquals(root[2][3]._state_id, thawed[2][3]._state_id)
+
+    def test_lazy_children(self):
+        root = Widget()
+        root.which = 'root'
+        for i in range(2):
+            root.append(Widget())
+            root[i].append(Widget())
+            root[i][0].which = (i, 0)
+        root.freeze()
+
+        # Only the root is thawed...
+        thawed = thaw(root._state_id)
+        self.assertEquals('root', thawed.which)
+        self.assertEquals(2, len(thawed))
+        self.assert_(isinstance(thawed.children[1], (int, long)))
+
+        # ... until a child is accessed, along with its subtree.
+        self.assertEquals((1, 0), thawed[1][0].which)
+        self.assertEquals(thawed[1], thawed[1][0].parent)
+        self.assert_(isinstance(thawed.children[0], (int, long)))
+
+        # map() thaws everything.
+        self.assertEquals(5, len(thawed.map(lambda w: w)))
+
+        # Lazy children freeze as they were.
+        lazy = thaw(root._state_id)
+        self.assertEquals(root.content_digest(), lazy.content_digest())
+
+    def test_shared_states(self):
+        # Identical children share their state, even within a tree.
+        root = Widget()
+        root.append(Widget())
+        root.append(Widget())
+        root[0].which = root[1].which = 'same'
+        root.freeze()
+        self.assertEquals(root[0]._state_id, root[1]._state_id)
+
+        # What is stored is what was digested.
+        digest, stored = WidgetState.objects.filter(pk=root[0]._state_id)\
+                                    .values_list('digest', 'widget')[0]
+        self.assertEquals(digest, hashlib.sha1(stored).hexdigest())
+
+        # ... but are thawed as separate widgets.
+        state = WidgetState.objects.get(pk=root._state_id)
+        self.assert_(state.widget[0] is not state.widget[1])
+        self.assertEquals(0, state.widget[0].parent_key)
+        self.assertEquals(1, state.widget[1].parent_key)
+
+        # Changing one doesn't affect the other.
+        root[1].which = 'different'
+        root[1].freeze()
+        self.assertNotEquals(root[0]._state_id, root[1]._state_id)
+        state = WidgetState.objects.get(pk=root._state_id)
+        self.assertEquals('same', state.widget[0].which)
+        self.assertEquals('different', state.widget[1].which)
+
+    def test_versions(self):
+        root = Widget()
+        root.append(Widget())
+        states = []
+        for i in range(4):
+            root.which = i
+            root.freeze()
+            states.append(root._state_id)
+
+        head = WidgetState.objects.get(pk=states[-1])
+        self.assertEquals(3, head.version)
+        self.assertEquals(states[0], head.origin_id)
+        # Only roots are numbered.
+        self.assertEquals(None, root[0].get_state_object().version)
+
+        nth_previous = WidgetState.objects.nth_previous
+        self.assertEquals((states[1], 3), nth_previous(states[-1], 2))
+        self.assertEquals((states[0], 3), nth_previous(states[-1], 3))
+        self.assertEquals((None, 3), nth_previous(states[-1], 4))
+
+        # Histories from before numbering are walked, & can be numbered.
+        WidgetState.objects.filter(pk__in=states[1:])\
+                           .update(origin=None, version=None)
+        self.assertEquals((states[1], 3), nth_previous(states[-1], 2))
+        self.assertEquals(3, WidgetState.objects.number_versions(states[-1]))
+        self.assertEquals(3, WidgetState.objects.get(pk=states[-1]).version)
+
+    def test_freeze_session(self):
+        root = Widget()
+        root.append(Widget())
+        root.freeze()
+        before = WidgetState.objects.count()
+
+        # Many freezes within a session make for a single new state per
+        # changed widget.
+        with freeze_session():
+            for i in range(5):
+                root[0].which = i
+                root[0].freeze()
+                root.freeze()
+        self.assertEquals(before + 2, WidgetState.objects.count())
+        self.assertEquals(4, root.get_state_object().widget[0].which)
+
+        # Nothing is frozen if the session fails.
+        def fail():
+            with freeze_session():
+                root[0].which = 'lost'
+                root[0].freeze()
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEquals(before + 2, WidgetState.objects.count())
+
+    def test_freeze_session_deleted(self):
+        root = Widget()
+        root.append(Widget())
+        root.append(Widget())
+        root.freeze()
+
+        # Widgets deleted within a session stay deleted.
+        with freeze_session():
+            root[1].which = 'changed'
+            root[1].freeze()
+            del root[1]
+        self.assertEquals([0], root.children.keys())
+        self.assertEquals([0], thaw(root._state_id).children.keys())
+
     def test_routing(self):
         root = Widget()
         root.append(MyWidget())
@@ -100,6 +262,43 @@ class TestWidget(unittest.TestCase):
         # Reverse.
         self.assertEquals('_2/_0/test-876', root[2][0].reverse('view_name', 876))
 
+    def test_dispatch(self):
+        root = Widget()
+        root.append(Widget())
+        root[0].append(Widget())
+        root[0].append(EchoWidget())
+
+        # The view of the widget at the end of the child segments gets
+        # the request & the arguments of the rest of the path.
+        request = object()
+        self.assertEquals((root[0][1], request, 'hi'),
+                          root.route(request, '_0/_1/echo/hi'))
+        view, args, kwargs = root.dispatch('_0/_1/echo/hi')
+        self.assert_(view.im_self is root[0][1])
+        self.assertEquals(((), {'word': 'hi'}), (args, kwargs))
+
+        # Missing children, at any level.
+        for path in ('_5/echo/hi', '_0/_5/echo/hi', '_0/_1/_0/echo/hi'):
+            self.assertRaises(Http404, root.dispatch, path)
+            self.assertRaises(Http404, root.route, request, path)
+
+    def test_url_prefix(self):
+        root = Widget()
+        root.append(Widget())
+        root.append(Widget())
+        child = MyWidget()
+        root[0].append(child)
+        self.assertEquals('_0/_0/', child.url_prefix)
+
+        # Prefixes follow widgets around.
+        del root[0][0]
+        root[1].append(child)
+        self.assertEquals('_1/_0/test-1', child.reverse('view_name', 1))
+
+        # Memoized prefixes aren't part of the state.
+        child.freeze()
+        self.assert_('_url_prefix' not in thaw(child._state_id).__dict__)
+
 def test_suite():
     from util.django_layer import make_django_suite
     return make_django_suite(__name__)
@@ -34,6 +34,27 @@ class TestWiki(django.test.TestCase):
             len(WikiPage.objects.filter(slug=slug, wiki__slug=wslug))
         )
 
+    def test_coordinates(self):
+        page = WikiPage.objects.get_or_create_wikipage(
+            'san-francisco-ca', 'Placed-page').page
+        # Pages keep their coordinates as strings.
+        page.latitude, page.longitude = '37.75', '-122.5'
+        page.freeze()
+
+        wiki_page = WikiPage.objects.get(pk=page.delegate.pk)
+        self.assertEquals((37.75, -122.5),
+                          (wiki_page.latitude, wiki_page.longitude))
+
+    def test_renamed(self):
+        page = WikiPage.objects.get_or_create_wikipage(
+            'san-francisco-ca', 'Named-page').page
+        prefix = page.url_prefix
+
+        # Links follow the page as it is renamed.
+        page.delegate.slug = 'Renamed-page'
+        self.assertNotEquals(prefix, page.url_prefix)
+        self.assertEquals(page.delegate.reverse(''), page.url_prefix)
+
 def test_suite():
     from util.django_layer import make_django_suite
     return make_django_suite(__name__)
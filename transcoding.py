@@ -302,13 +302,13 @@ def transcode_wiki_to_onecolumnpage(wiki_page, page, later_than=None):
                 # Extra freeze first time so page starts from an empty state
                 first = False
                 page.freeze()
-            page.freeze()
-            # Re-use the same state_id for additonal freezes on this object
-            # this wiki version transcode
-            transcoding.state_id = page.get_state_id()
-            append_wiki_to_onecolumnpage(version, page)
-            transcoding.create_change = True
-            page.freeze()
+            # Each wiki version makes for a single root state & a single
+            # change row (``create_change'' is taken by the one
+            # ``WikiPage.freeze'' the session ends with).
+            with freeze_session():
+                append_wiki_to_onecolumnpage(version, page)
+                transcoding.create_change = True
+                page.freeze()
             
     # Migrate any feedback from wiki page to widget page delegate
     Feedback.objects.migrate_feedback_to_new_object(wiki_page, page.delegate)
@@ -35,5 +35,7 @@ urlpatterns = patterns('',
         name='widgets_browser_ajax'),
     url(r'^create_page_dialog$', views.create_page_dialog,
         name='widgets_create_page_dialog'),
+    url(r'^handler_stats$', views.handler_stats,
+        name='widgets_handler_stats'),
     
 )
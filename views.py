@@ -17,9 +17,12 @@ from util.db  import nestable_commit_on_success
 from util.dict import getvalues
 from util.seq import first
 
+from .            import metrics, pagecache
 from .forms       import CreatePageForm
 from .models      import WikiHome, WikiPage
-from .page        import OneColumnPage, NeedsAuthentication, NeedsCaptcha
+from .page        import (OneColumnPage, NeedsAuthentication, NeedsCaptcha,
+                          etag_of_page)
+from .router      import is_not_modified, not_modified
 from .transcoding import append_wiki_to_onecolumnpage
 
 from www.common                  import render_to_response, context as ctx
@@ -43,8 +46,27 @@ def wiki_page(request, wiki_slug, page_slug, rest):
 def _wiki_page(request, wiki_slug, page_slug, rest):
     """Route the request through a widget tree addressed by
     `wiki_slug' and `page_slug' (whose head is kept in a ``WikiPage'')"""
-    return WikiPage.objects.get_or_create_wikipage(
-        wiki_slug, page_slug).page(request, rest)
+    wikipage = WikiPage.objects.get_or_create_wikipage(wiki_slug, page_slug)
+
+    # Conditional GETs are answered before anything is thawed.
+    etag = None
+    if request.method in ('GET', 'HEAD'):
+        etag = etag_of_page(request, wikipage.head_id, rest)
+        if etag is not None and is_not_modified(request, etag):
+            return not_modified(etag)
+
+    response = pagecache.cached_response(request, wikipage, rest,
+                                         lambda: wikipage.page(request, rest))
+    if etag is not None and response.status_code == 200:
+        response['ETag'] = etag
+    return response
+
+def handler_stats(request):
+    """Show the instrumentation of widget handlers (see ``metrics'')
+    in this process, to staff."""
+    if not (settings.DEBUG or request.user.is_staff):
+        return HttpResponseForbidden('Staff only')
+    return HttpResponse(metrics.REGISTRY.dump(), mimetype='text/plain')
 
 def _split_best_ofs(page_set):
     try:
@@ -1,21 +1,111 @@
 """Provide the basis of the stateful widget hierarchy & request
 routing."""
 from __future__ import absolute_import
+from __future__ import with_statement
 
-from copy import copy
+import hashlib
+import re
+from contextlib import contextmanager
+from copy       import copy
 
 from lxml.html import fromstring
 
 from django.http               import HttpResponse, Http404
-from django.db                 import transaction
+from django.conf               import settings
+from django.db                 import transaction, IntegrityError
 from django.conf.urls.defaults import url
 
-from util.dynvar     import bindings
+from util.dynvar     import binding, bindings
 from util.functional import concat, dictmap
 
-from .       import html
+from .       import html, metrics
 from .models import WidgetState
+from .codec  import Encoded, encode
 from .router import Routable, view
+from .loader import thaw_children
+
+DEDUPLICATE_STATES = getattr(settings, 'WIDGETS_DEDUPLICATE_STATES', True)
+
+# | Freeze sessions.
+#
+# Handling a single request can freeze the same widgets many times
+# over: a widget freezes itself, then each of its ancestors up to the
+# root, which also freezes its delegate. Within a freeze session,
+# freezing only marks widgets (& their ancestors) dirty, and each of
+# them is frozen exactly once as the session ends, deepest first.
+class FreezeSession(object):
+    def __init__(self):
+        self.dirty   = {}               # id(widget) -> widget
+        self.current = []               # stack of widgets being frozen
+
+    def is_dirty(self, widget):
+        return id(widget) in self.dirty
+
+    def is_freezing(self, widget):
+        return bool(self.current) and self.current[-1] is widget
+
+    def mark(self, widget):
+        while widget is not None:
+            self.dirty[id(widget)] = widget
+            widget = widget.parent
+
+    def freeze_now(self, widget):
+        """Freeze `widget' right away (its ancestors stay dirty)."""
+        self.dirty.pop(id(widget), None)
+        self.current.append(widget)
+        try:
+            widget.freeze()
+        finally:
+            self.current.pop()
+
+    def flush(self):
+        def depth(widget):
+            return widget.parent and 1 + depth(widget.parent) or 0
+
+        while self.dirty:
+            widget = max(self.dirty.values(), key=depth)
+            if is_attached(widget):
+                self.freeze_now(widget)
+            else:
+                # Deleted within the session: freezing it would put
+                # it back into its parent.
+                self.dirty.pop(id(widget))
+
+def is_attached(widget):
+    """Whether `widget' is still where it is in its tree (ie. it
+    hasn't been deleted from it)."""
+    while widget.parent is not None:
+        if widget.parent.children.get(widget.parent_key) is not widget:
+            return False
+        widget = widget.parent
+    return True
+
+@contextmanager
+def freeze_session():
+    """Coalesce the freezes made within the block. Nested sessions
+    join the outermost one. Nothing is frozen if the block raises."""
+    session = getattr(bindings, 'freeze_session', None)
+    if session is not None:
+        yield session
+        return
+
+    session = FreezeSession()
+    with binding(freeze_session=session):
+        yield session
+        session.flush()
+
+def coalesced(freeze):
+    """Decorates ``freeze()'' implementations to only mark the widget
+    dirty within a freeze session, unless the session is freezing it."""
+    def decorated(self):
+        session = getattr(bindings, 'freeze_session', None)
+        if session is None or session.is_freezing(self):
+            return freeze(self)
+        session.mark(self)
+
+    decorated.__name__ = freeze.__name__
+    decorated.__doc__  = freeze.__doc__
+    return decorated
 
 class Widget(Routable):
     """The ``Widget'' is a routable object that exists in a tree with
@@ -57,7 +147,7 @@ class Widget(Routable):
 
     # Widgets look like dicts of other widgets:
     def __getitem__(self, index):
-        return self.children[index]
+        return self.thawed_children([index])[index]
 
     def __delitem__(self, index):
         del self.children[index]
@@ -75,7 +165,7 @@ class Widget(Routable):
         return self.children.iterkeys()
     
     def items(self):
-        return self.children.items()
+        return self.thawed_children().items()
 
     def __nonzero__(self):              # bool(widget) == True always
         return True
@@ -83,13 +173,31 @@ class Widget(Routable):
     def map(self, fun):
         """Map over self & all children recursively."""
         return [fun(self)] + \
-               [v for child in self.children.itervalues()
+               [v for child in self.thawed_children().itervalues()
                   for v in child.map(fun)]
 
+    def thawed_children(self, keys=None):
+        """Return our children, making sure the ones at `keys' (or all
+        of them) are thawed. A thawed widget holds on to the state ids
+        of its children until they are accessed, then thaws their
+        subtrees in bulk."""
+        if keys is None:
+            keys = self.children.keys()
+        lazy = [key for key in keys
+                    if isinstance(self.children.get(key), (int, long))]
+        if lazy:
+            thaw_children(self, lazy)
+        return self.children
+
     # | State management.
     def get_state_id(self):
         """Get the state id. If we don't have one yet, we produce one."""
-        if not self._state_id:
+        session = getattr(bindings, 'freeze_session', None)
+        if session is not None and (not self._state_id
+                                    or session.is_dirty(self)):
+            # Our state id has to reflect our changes so far.
+            session.freeze_now(self)
+        elif not self._state_id:
             self.freeze()
         return self._state_id
 
@@ -97,6 +205,7 @@ class Widget(Routable):
         """ Get the state object using get_state_id. """
         return WidgetState.objects.get(pk=self.get_state_id())
 
+    @coalesced
     def freeze(self):
         """Freezes the state of the widget onto a WidgetState instance as-is.
 
@@ -105,35 +214,70 @@ class Widget(Routable):
         of its children and properties such as html_blob will not reflect the
         most recent state of the widget's children.
 
+        Within a ``freeze_session()'', this only marks the widget (and
+        its ancestors) to be frozen when the session ends.
+
         TODO: Fix this so that parents freeze their children when necessary.
         """
         # TODO: use nested transactions here?
         #
+        metrics.count_freeze()
         self.freezing = True
         try:
-            if self._state_id and self._state_id == getattr(
-                    bindings, 'transcoding', {}).get('state_id'):
-                # During transcoding, overwrite page state instead of linking
-                # to a newly created state.  A page root should only have 1
-                # version per wiki version no matter how many freezes occurred
-                # in transcoding.
-                old = WidgetState.objects.get(pk=self._state_id)
-                old.widget = self
-                old.save()
+            if self.parent and DEDUPLICATE_STATES:
+                # Children are often frozen again without any change
+                # (eg. transcoding rebuilds every widget for every wiki
+                # version), so we share identical states.
+                self.freeze_shared()
             else:
-                # This is a bit ugly. We could get around it by having the
-                # PickleField inform the instance after unpickling of its
-                # state ID. For now, this will do.
-                new = WidgetState(widget=self, previous_id=self._state_id)
-                new.save()
-                self._state_id = new.widget._state_id = new.pk
-                new.save()
+                self.freeze_new()
     
             if self.parent:
                 self.parent.update(self)
         finally:
             del self.freezing
 
+    def freeze_new(self, digest=None, encoded=None):
+        # Our state id isn't part of our frozen state (it's given back
+        # to us when we're thawed), so a single INSERT will do. We may
+        # have been `encoded' already.
+        new = WidgetState(widget=encoded or self,
+                          previous_id=self._state_id, digest=digest)
+        if not self.parent:
+            # Number the versions of roots (ie. pages), see
+            # ``Page.prev''.
+            new.follow(self._state_id)
+        new.save()
+        self._state_id = new.pk
+
+    def freeze_shared(self):
+        """Freeze onto an existing state with the same contents, if
+        there is one."""
+        encoded = Encoded(encode(self))
+        digest  = self.content_digest(encoded)
+        shared  = WidgetState.objects.filter(digest=digest)\
+                                     .values_list('pk', flat=True)
+        if shared:
+            self._state_id = shared[0]
+            return
+
+        # Someone may beat us to it. Failing the INSERT mustn't abort
+        # the transaction, and their state may not be visible to us
+        # yet: ours then goes unshared.
+        savepoint = transaction.savepoint()
+        try:
+            self.freeze_new(digest, encoded)
+        except IntegrityError:
+            transaction.savepoint_rollback(savepoint)
+            self.freeze_new(None, encoded)
+        else:
+            transaction.savepoint_commit(savepoint)
+
+    def content_digest(self, encoded=None):
+        """The digest of our frozen state (or of its `encoded'
+        form)."""
+        return hashlib.sha1(encoded or encode(self)).hexdigest()
+
     def update(self, child):
         # Called from a child: they are notifying us of an update.
         # Ignore this if we are in the process of freezing already
@@ -144,13 +288,41 @@ class Widget(Routable):
 
     # | Forward & reverse URL routing
     #
-    # This is nice & simple since we already have a tree.
+    # This is nice & simple since we already have a tree: the leading
+    # ``handle_child'' segments of a path are walked down directly, and
+    # only the rest is resolved, by the widget they lead to. Only the
+    # ``__call__'' of the widget routed to (ie. the page) runs: the
+    # widgets on the way neither answer conditional GETs (see
+    # ``Routable.etag'') nor are measured.
+    CHILD_SEGMENT_RE = re.compile(r'^_(\d+)/')
+
+    def route(self, request, path):
+        view, args, kwargs = self.dispatch(path)
+        return view(request, *args, **kwargs)
+
+    def dispatch(self, path):
+        """Resolve `path' to the view of the widget of our subtree it
+        is for, walking down to it directly."""
+        widget = self
+        match  = self.CHILD_SEGMENT_RE.match(path)
+        while match:
+            try:
+                widget = widget[int(match.group(1))]
+            except KeyError:
+                raise Http404
+            path  = path[match.end():]
+            match = self.CHILD_SEGMENT_RE.match(path)
+
+        return widget.resolve(path)
+
     @view('^_(?P<child_key>\d+)/(?P<rest>.*)')
     def handle_child(self, request, child_key, rest):
-        # If we have a valid child, simply route down the tree.
+        """The view the URLs of our children are reversed to (see
+        ``reverse_child''). Routing walks down to them without it (see
+        ``dispatch''), unless it is resolved directly."""
         child_key = int(child_key)
         try:
-            return self.children[child_key](request, rest)
+            return self[child_key](request, rest)
         except KeyError:
             raise Http404
 
@@ -158,11 +330,25 @@ class Widget(Routable):
         return self.reverse(self.handle_child, child.parent_key, rest)
 
     def reverse(self, view, *args, **kwargs):
-        fragment = super(Widget, self).reverse(view, *args, **kwargs)
-        if self.parent:
-            return self.parent.reverse_child(self, fragment)
-        else:
-            return fragment
+        return self.url_prefix + \
+               super(Widget, self).reverse(view, *args, **kwargs)
+
+    @property
+    def url_prefix(self):
+        """The URL our views are reversed under: that of our parent's
+        ``handle_child'' for us. It is memoized along with where it
+        was computed for in the tree, so that moving us around makes
+        for a new one."""
+        if not self.parent:
+            return ''
+
+        parent_prefix = self.parent.url_prefix
+        memo = getattr(self, '_url_prefix', None)
+        if memo is None or memo[:2] != (parent_prefix, self.parent_key):
+            memo = self._url_prefix = (
+                parent_prefix, self.parent_key,
+                self.parent.reverse_child(self, ''))
+        return memo[2]
 
     # | Views.
     @view('^$', 'root')
@@ -187,8 +373,8 @@ class Widget(Routable):
         else:
             links = []
 
-        return links + concat(child.links()
-                              for child in self.children.itervalues())
+        children = self.thawed_children()
+        return links + concat(child.links() for child in children.itervalues())
 
     def tokens(self):
         """Return a list of string tokens from the plain text representation 
@@ -198,8 +384,9 @@ class Widget(Routable):
         else:
             tokens = []
 
+        children = self.thawed_children()
         return tokens + concat(child.tokens()
-                               for child in self.children.itervalues())
+                               for child in children.itervalues())
 
     def make_duplicate(self, new_state_id):
         """ Returns a copy of this widget with _state_id changed to
@@ -222,6 +409,21 @@ class Widget(Routable):
         else:
             return '_root'
 
+    def widget_of_namespace(self, namespace):
+        """Return the widget of our subtree whose namespace is
+        `namespace' (we are at its root), either as ``namespace'' has it
+        (`_root_3') or as protected in the page (`_root_3_')."""
+        keys = namespace.rstrip('_').split('_')
+        if keys[:2] != ['', 'root']:
+            raise Http404, 'No widget %r' % namespace
+        widget = self
+        try:
+            for key in keys[2:]:
+                widget = widget[int(key)]
+        except (KeyError, ValueError):
+            raise Http404, 'No widget %r' % namespace
+        return widget
+
     # | CSS/styling
     css_container = None
     css_contents  = None
@@ -248,29 +450,27 @@ class Widget(Routable):
     # | Pickling support.
     #
     # We map child states onto their state IDs (also making sure they
-    # are frozen in the process) in order to save space.
+    # are frozen in the process) in order to save space. Children that
+    # haven't been thawed are still state IDs.
     def __getstate__(self):
         dict = super(Widget, self).__getstate__()
         dict['children'] = dictmap(
-            lambda k,v: (k, v.get_state_id()),
+            lambda k,v: (k, v if isinstance(v, (int, long))
+                              else v.get_state_id()),
             dict['children'])
-        for k in ('parent', 'parent_key', 'freezing'):
+        # Our state id is that of the state we're frozen onto, so it
+        # is restored by whoever thaws us.
+        for k in ('parent', 'parent_key', 'freezing', '_state_id',
+                  '_url_prefix'):
             dict.pop(k, None)
 
         return dict
 
     def __setstate__(self, dict):
-        # Convert widget state ids back into happy child objects when restoring
-        # from a frozen state.
-        dict['children'] = dictmap(
-            lambda k,v: (k, WidgetState.objects.get(pk=v).widget),
-            dict['children'])
-
         self.parent     = None
         self.parent_key = None
+        # Older states carry their own id.
+        self._state_id  = None
         self.__dict__.update(dict)
-
-        # Restore the parent reference.
-        for key, child in self.children.iteritems():
-            child.parent     = self
-            child.parent_key = key
+        # Our children are still state ids at this point: they are
+        # thawed on first access (see ``thawed_children'').